@@ -1,12 +1,16 @@
 import streamlit as st
 import os
+import re
 import requests
-import ssl
-import socket
 import time
 from datetime import datetime
+from urllib.parse import urlsplit
 from duckduckgo_search import DDGS
 
+from fetcher import get_document, get_session, text_decoder
+from metrics import get_metrics
+from signatures import load_registry
+
 # ============================================================
 # NO CREWAI — everything built from scratch
 # ============================================================
@@ -97,7 +101,7 @@ class LLM:
 
         for attempt in range(2):
             try:
-                resp = requests.post(
+                resp = get_session().post(
                     self.ROUTER_URL, headers=headers, json=payload, timeout=120
                 )
 
@@ -146,23 +150,34 @@ class LLM:
 # ============================================================
 # TOOLS
 # ============================================================
+def find_target(text: str) -> str:
+    # Tools are handed the whole task description; pull the site out of it
+    m = re.search(r"https?://[^\s'\"<>]+|(?:[a-z0-9-]+\.)+[a-z]{2,}(?:/[^\s'\"<>]*)?", text, re.I)
+    return m.group(0).rstrip(".,)") if m else text.strip()
+
+
+# ScraperTool and SSLTool both read the same Document (fetcher.get_document),
+# so auditing a site costs one request, and the certificate we report is
+# the one the page was actually served with.
 class SSLTool:
     name = "SSL Inspector"
 
     def run(self, target: str) -> str:
-        hostname = target.replace("https://", "").replace("http://", "").split("/")[0]
-        try:
-            ctx = ssl.create_default_context()
-            with socket.create_connection((hostname, 443), timeout=5) as sock:
-                with ctx.wrap_socket(sock, server_hostname=hostname) as ssock:
-                    cert = ssock.getpeercert()
-                    return f"✅ SSL VALID for {hostname}. Issuer: {cert.get('issuer','Unknown')}"
-        except ssl.SSLCertVerificationError:
+        with get_metrics().timed("ssl_tool"):
+            document = get_document(find_target(target), headers=HEADERS, use_cache=False)
+            get_metrics().record(document.timings, "ssl_tool")
+        hostname = urlsplit(document.final_url).hostname
+        error = document.error
+        if isinstance(error, requests.exceptions.SSLError):
             return f"❌ SSL verification FAILED for {hostname}"
-        except socket.timeout:
+        if isinstance(error, requests.exceptions.Timeout):
             return f"❌ Connection timed out for {hostname}"
-        except Exception as e:
-            return f"❌ SSL error: {e}"
+        if error:
+            return f"❌ SSL error: {error}"
+        cert = document.peer_cert
+        if not cert:
+            return f"❌ No SSL: {hostname} is served over plain HTTP"
+        return f"✅ SSL VALID for {hostname}. Issuer: {cert.get('issuer','Unknown')}"
 
 
 class SearchTool:
@@ -190,26 +205,28 @@ class ScraperTool:
 
     def run(self, target: str) -> str:
         try:
-            resp = requests.get(target, headers=HEADERS, timeout=10)
-            resp.raise_for_status()
-            low = resp.text.lower()
-            checks = {
-                "React":      ["react", "reactdom"],
-                "Vue.js":     ["vue.js", "vue.min"],
-                "Angular":    ["angular", "ng-app"],
-                "Next.js":    ["__next", "next.js"],
-                "WordPress":  ["wp-content", "wordpress"],
-                "Shopify":    ["shopify", "cdn.shopify"],
-                "Bootstrap":  ["bootstrap"],
-                "Tailwind CSS": ["tailwind"],
-                "jQuery":     ["jquery"],
-            }
-            tech = [n for n, kws in checks.items() if any(k in low for k in kws)]
-            tech_str = ", ".join(tech) if tech else "Standard HTML/CSS/JS"
+            metrics = get_metrics()
+            with metrics.timed("scraper_tool"):
+                document = get_document(find_target(target), headers=HEADERS, use_cache=False)
+                try:
+                    if document.error:
+                        raise document.error
+                    if document.status_code >= 400:
+                        return f"❌ Scrape error: HTTP {document.status_code} for {document.final_url}"
+
+                    # Signatures were matched while the page downloaded; only the
+                    # first 2500 bytes get decoded, for the preview
+                    tech = [sig["name"] for sig in document.signatures]
+                    tech_str = ", ".join(tech) if tech else "Standard HTML/CSS/JS"
+                    with document.timings.stage("parse"):
+                        preview = text_decoder(document).decode(document.body[:2500], final=True)
+                finally:
+                    metrics.record(document.timings, "scraper_tool")
             return (
-                f"✅ Scraped {target}\n"
-                f"📦 Tech Stack: {tech_str}\n\n"
-                f"Source Preview:\n{resp.text[:2500]}"
+                f"✅ Scraped {document.final_url}\n"
+                f"📦 Tech Stack: {tech_str}\n"
+                f"🔖 Signature set: {load_registry().version}\n\n"
+                f"Source Preview:\n{preview}"
             )
         except Exception as e:
             return f"❌ Scrape error: {e}"
@@ -364,7 +381,7 @@ def validate_license(key):
     url = f"https://api.keygen.sh/v1/accounts/{KEYGEN_ACCOUNT_ID}/licenses/actions/validate-key"
     hdrs = {"Content-Type": "application/vnd.api+json", "Accept": "application/vnd.api+json"}
     try:
-        resp = requests.post(url, headers=hdrs, json={"meta": {"key": key}}, timeout=10)
+        resp = get_session().post(url, headers=hdrs, json={"meta": {"key": key}}, timeout=10)
         data = resp.json()
         if resp.status_code != 200 or data.get("errors"):
             st.error(f"❌ API Error: {data}")
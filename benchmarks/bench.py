@@ -0,0 +1,303 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Measure the real fetch path, not the on-disk cache, and import the
+# package from the repo root. The whole corpus is on one host, so the
+# per-host politeness limits are lifted unless set explicitly.
+os.environ["SIGNALIQ_CACHE"] = ""
+for name in ("SIGNALIQ_HOST_RATE", "SIGNALIQ_HOST_BURST", "SIGNALIQ_IP_RATE", "SIGNALIQ_IP_BURST"):
+    os.environ.setdefault(name, "1000")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import PAGE_KINDS, build_corpus, edge_case_pages  # noqa: E402
+from server import CorpusServer  # noqa: E402
+from signatures import load_registry  # noqa: E402
+
+
+# ============================================================
+# BENCHMARKS
+#
+# Runs each engine over the generated corpus (corpus.py); the network
+# engines fetch it from a local CorpusServer (server.py), so nothing
+# leaves the machine. For every engine and page kind it reports
+# pages/sec, p50/p99 latency per page and peak traced memory.
+#
+#   python benchmarks/bench.py                        # everything
+#   python benchmarks/bench.py --engines detect,analyze_html --repeat 20
+#   python benchmarks/bench.py --latency 50 --json now.json
+#   python benchmarks/bench.py --baseline before.json # exit 1 on regression
+#   python benchmarks/bench.py --check --seed 3       # detections only, see below
+#
+# Engines:
+#   detect          registry.detect on the page bytes (the matcher alone)
+#   analyze_html    main.analyze_html on the page text
+#   legacy_bs       the original BeautifulSoup + per-signature regex
+#                   analyze_html, for comparison (needs beautifulsoup4)
+#   analyze_target  main.analyze_target against the local server
+#   scraper_tool    app.ScraperTool.run against the local server
+#                   (needs the app's dependencies)
+#   bulk_scan       scanner.scan_websites over every page at once
+#
+# --check times nothing. It runs the corpus and the edge case pages
+# through legacy_bs and through the registry (detect on the whole page,
+# and a DocumentScanner fed the page in random chunks), and exits 1 if
+# any page's tag-scope detections differ. Needs beautifulsoup4.
+# ============================================================
+
+ENGINES = ("detect", "analyze_html", "legacy_bs", "analyze_target", "scraper_tool", "bulk_scan")
+
+
+def _quiet_import(name):
+    # Keep anything printed at import time (app.py, older main.py) out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return __import__(name)
+
+
+def _legacy_engine():
+    import re
+    from bs4 import BeautifulSoup
+
+    registry = load_registry()
+    patterns = [
+        (sig["name"], sig.get("points", 0),
+         re.compile("|".join([re.escape(k) for k in sig.get("keywords", [])] + sig.get("regex", [])), re.IGNORECASE))
+        for sig in registry.signatures if sig.get("scope") == "tags"
+    ]
+
+    def analyze(html):
+        soup = BeautifulSoup(html, 'html.parser')
+        raw_code = " ".join(map(str, soup.find_all(['script', 'link'])))
+        found = [(name, points) for name, points, pattern in patterns if pattern.search(raw_code)]
+        return [name for name, _ in found], sum(points for _, points in found)
+
+    return analyze
+
+
+def make_engine(name, pages, server):
+    """A function kind -> None that runs one page through the engine, or None if unavailable."""
+    registry = load_registry()
+    texts = {kind: body.decode("utf-8") for kind, body in pages.items()}
+
+    if name == "detect":
+        return lambda kind: registry.detect(pages[kind])
+    if name == "analyze_html":
+        main = _quiet_import("main")
+        return lambda kind: main.analyze_html(texts[kind])
+    if name == "legacy_bs":
+        try:
+            analyze = _legacy_engine()
+        except ImportError:
+            return None
+        return lambda kind: analyze(texts[kind])
+    if name == "analyze_target":
+        main = _quiet_import("main")
+
+        def run(kind):
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.analyze_target(server.url(kind))
+        return run
+    if name == "scraper_tool":
+        try:
+            app = _quiet_import("app")
+        except ImportError:
+            return None
+        import fetcher
+        tool = app.ScraperTool()
+
+        def run(kind):
+            # The tools share recently fetched Documents; start cold every time
+            fetcher._recent_documents.clear()
+            tool.run(f"Scrape {server.url(kind)} for its stack")
+        return run
+    if name == "bulk_scan":
+        import scanner
+
+        def run(kinds):
+            with contextlib.redirect_stdout(io.StringIO()):
+                scanner.scan_websites([server.url(kind) for kind in kinds])
+        return run
+    raise ValueError(f"Unknown engine {name!r}")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(run, arg, repeat):
+    run(arg)  # warm up (compiles, connection pools, imports)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(arg)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return timings, peak
+
+
+def row(engine, kind, pages_per_call, timings, peak):
+    return {
+        "engine": engine,
+        "kind": kind,
+        "pages_per_sec": round(pages_per_call * len(timings) / sum(timings), 2),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(engines, repeat, latency, seed=0):
+    registry = load_registry()
+    pages = build_corpus(registry, seed)
+    rows = []
+    with CorpusServer(pages, latency=latency) as server:
+        for engine in engines:
+            run = make_engine(engine, pages, server)
+            if run is None:
+                print(f"  {engine}: skipped (dependencies not installed)")
+                continue
+            if engine == "bulk_scan":
+                timings, peak = measure(run, PAGE_KINDS, repeat)
+                rows.append(row(engine, "all", len(PAGE_KINDS), timings, peak))
+                print_row(rows[-1])
+                continue
+            for kind in PAGE_KINDS:
+                timings, peak = measure(run, kind, repeat)
+                rows.append(row(engine, kind, 1, timings, peak))
+                print_row(rows[-1])
+    return {
+        "signature_version": registry.version,
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "latency_ms": latency * 1000,
+        "results": rows,
+    }
+
+
+def print_row(r):
+    print(f"  {r['engine']:<15} {r['kind']:<16} {r['pages_per_sec']:>10.2f} pages/s"
+          f"  p50 {r['p50_ms']:>9.2f} ms  p99 {r['p99_ms']:>9.2f} ms  peak {r['peak_kb']:>9.1f} KB")
+
+
+def compare(report, baseline, tolerance):
+    """Print each result against the baseline; return the regressions."""
+    before = {(r["engine"], r["kind"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for r in report["results"]:
+        old = before.get((r["engine"], r["kind"]))
+        if old is None:
+            continue
+        speed = r["pages_per_sec"] / old["pages_per_sec"] - 1 if old["pages_per_sec"] else 0
+        memory = r["peak_kb"] / old["peak_kb"] - 1 if old["peak_kb"] else 0
+        flags = []
+        if speed < -tolerance:
+            flags.append("SLOWER")
+        if memory > tolerance:
+            flags.append("MORE MEMORY")
+        print(f"  {r['engine']:<15} {r['kind']:<16} speed {speed:+7.1%}  memory {memory:+7.1%}  {' '.join(flags)}")
+        if flags:
+            regressions.append((r["engine"], r["kind"], flags))
+    return regressions
+
+
+def check_detections(seed=0, chunkings=5):
+    """Compare tag-scope detections of legacy_bs and the registry on every corpus
+    and edge case page. Prints the pages that differ; returns how many did."""
+    registry = load_registry()
+    legacy = _legacy_engine()
+    tag_names = {sig["name"] for sig in registry.signatures if sig.get("scope") == "tags"}
+    pages = dict(build_corpus(registry, seed))
+    pages.update(edge_case_pages(registry, seed))
+    rng = random.Random(seed)
+
+    def tags_of(found):
+        return sorted(sig["name"] for sig in found if sig["name"] in tag_names)
+
+    mismatches = 0
+    for name, page in pages.items():
+        expected = sorted(legacy(page.decode("utf-8"))[0])
+        results = {"detect": tags_of(registry.detect(page))}
+        for n in range(chunkings):
+            # Chunk boundaries anywhere, down to a byte
+            scanner = registry.scanner()
+            at = 0
+            while at < len(page):
+                size = rng.choice((1, 7, 64, 1024, 64 * 1024))
+                scanner.feed(page[at:at + size])
+                at += size
+            results[f"chunked_{n}"] = tags_of(scanner.close())
+        wrong = {how: found for how, found in results.items() if found != expected}
+        if wrong:
+            mismatches += 1
+            print(f"  {name}: legacy_bs {expected}")
+            for how, found in wrong.items():
+                print(f"  {'':<{len(name)}}  {how} {found}")
+    print(f"{len(pages)} pages, {mismatches} with different detections")
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SignalIQ detection and fetch benchmarks")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="comma-separated, from: " + ", ".join(ENGINES))
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per engine and page (default 5)")
+    parser.add_argument("--latency", type=float, default=0, help="server latency per request, in ms")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against a report written earlier with --json")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown / memory growth (default 0.15)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare detections against legacy_bs instead of timing (exit 1 if any differ)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        try:
+            import bs4  # noqa: F401
+        except ImportError:
+            parser.error("--check needs beautifulsoup4")
+        print(f"Checking detections against legacy_bs (seed {args.seed})")
+        return 1 if check_detections(args.seed) else 0
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"Benchmarking {', '.join(engines)} ({args.repeat} runs, {args.latency:g} ms latency)")
+    report = run_benchmarks(engines, args.repeat, args.latency / 1000, args.seed)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to: {args.json}")
+
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
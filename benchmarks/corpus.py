@@ -0,0 +1,136 @@
+import random
+
+
+# ============================================================
+# BENCHMARK CORPUS
+#
+# Generated pages, so the benchmarks run offline and give the same
+# numbers on every machine with the same seed. Each kind stresses a
+# different part of the detection path:
+#
+#   small            a typical landing page shell (~8 KB)
+#   medium           a content page (~250 KB)
+#   large            a multi-MB page, past fetcher.MAX_PAGE_BYTES
+#   script_heavy     hundreds of <script>/<link> tags and inline code
+#   signature_dense  every signature keyword, many times over
+#   signature_free   plenty of markup, but no signature anywhere
+#
+# edge_case_pages() makes small pages that put signature keywords in
+# the places a tag scanner can get wrong (comments, <style>, uppercase
+# and unquoted tags, other tags' attributes, plain text). They are for
+# checking detections (bench.py --check), not for timing.
+# ============================================================
+
+# Filler words that contain none of the signature keywords
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt "
+    "labore et dolore magna aliqua enim minim veniam quis nostrud exercitation ullamco laboris "
+    "nisi aliquip ex ea commodo consequat duis aute irure in voluptate velit esse cillum"
+).split()
+
+PAGE_KINDS = ("small", "medium", "large", "script_heavy", "signature_dense", "signature_free")
+
+
+def _text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def _paragraphs(rng, size):
+    parts = []
+    length = 0
+    while length < size:
+        part = f'<div class="c{rng.randrange(100)}"><p>{_text(rng, rng.randrange(200, 1200))}</p></div>\n'
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def _page(head, body):
+    return f"<!DOCTYPE html>\n<html>\n<head>\n{head}</head>\n<body>\n{body}</body>\n</html>\n"
+
+
+def _shop_head():
+    return (
+        '<link rel="stylesheet" href="https://cdn.shopify.com/s/files/theme.css">\n'
+        '<script src="https://www.googletagmanager.com/gtm.js?id=GTM-XXXX"></script>\n'
+        "<script>window.dataLayer = window.dataLayer || []; gtag('config', 'G-123');</script>\n"
+    )
+
+
+def make_page(kind, rng, keywords=()):
+    """One page of the given kind, as UTF-8 bytes."""
+    if kind == "small":
+        html = _page(_shop_head(), _paragraphs(rng, 6 * 1024))
+    elif kind == "medium":
+        html = _page(_shop_head(), _paragraphs(rng, 250 * 1024))
+    elif kind == "large":
+        html = _page(_shop_head(), _paragraphs(rng, 3 * 1024 * 1024))
+    elif kind == "script_heavy":
+        tags = []
+        for n in range(400):
+            if n % 3 == 0:
+                tags.append(f'<script>var m{n} = {{"k": "{_text(rng, 600)}"}};</script>\n')
+            elif n % 3 == 1:
+                tags.append(f'<script src="https://static.example.net/js/chunk-{n}.{rng.randrange(10**8):08x}.js" async></script>\n')
+            else:
+                tags.append(f'<link rel="preload" href="https://static.example.net/css/{n}.css" as="style">\n')
+        html = _page(_shop_head() + "".join(tags), _paragraphs(rng, 100 * 1024))
+    elif kind == "signature_dense":
+        scripts = []
+        for _ in range(40):
+            for keyword in keywords:
+                scripts.append(f'<script src="https://{keyword}/x.js?v={rng.randrange(1000)}"></script>\n')
+        body = "".join(f"<p>{_text(rng, 300)} {keyword}</p>\n" for keyword in keywords * 20)
+        html = _page("".join(scripts), body + _paragraphs(rng, 100 * 1024))
+    elif kind == "signature_free":
+        head = '<link rel="stylesheet" href="/main.css">\n<script src="/app.js"></script>\n'
+        html = _page(head, _paragraphs(rng, 300 * 1024))
+    else:
+        raise ValueError(f"Unknown page kind {kind!r}")
+    return html.encode("utf-8")
+
+
+def build_corpus(registry, seed=0, kinds=PAGE_KINDS):
+    """{kind: page bytes} for every kind, using registry's keywords for the dense page."""
+    rng = random.Random(seed)
+    keywords = [keyword for sig in registry.signatures for keyword in sig.get("keywords", [])]
+    return {kind: make_page(kind, rng, keywords) for kind in kinds}
+
+
+# Where a keyword can sit; only the <script>/<link> ones count for tag-scope signatures
+EDGE_SNIPPETS = (
+    '<!-- <script src="https://{k}/commented.js"></script> -->\n',
+    "<style>.hero {{ background: url(https://{k}/bg.png) }}</style>\n",
+    "<SCRIPT SRC=https://{k}/upper.js></SCRIPT>\n",
+    '<link rel=preload href="https://{k}/style.css"/>\n',
+    '<script src="https://{k}/self-closing.js"/>\n',
+    '<img src="https://{k}/pixel.gif" alt="">\n',
+    "<p>We do not use {k} here.</p>\n",
+    '<script>var src = "https://{k}/inline.js"; // {k}</script>\n',
+    '<script type="application/ld+json">{{"url": "https://{k}/"}}</script>\n',
+    "<noscript><img src='https://{k}/noscript.gif'></noscript>\n",
+    '<div data-src="https://{k}/lazy.js"></div>\n',
+)
+
+
+def edge_case_pages(registry, seed=0, count=50):
+    """{name: page bytes}: count pages, each a random mix of EDGE_SNIPPETS filled
+    with registry keywords, plus one page per snippet with every keyword."""
+    rng = random.Random(seed)
+    keywords = [keyword for sig in registry.signatures for keyword in sig.get("keywords", [])]
+    pages = {}
+    for n, snippet in enumerate(EDGE_SNIPPETS):
+        pages[f"snippet_{n}"] = _page("", "".join(snippet.format(k=k) for k in keywords)).encode("utf-8")
+    for n in range(count):
+        parts = [rng.choice(EDGE_SNIPPETS).format(k=rng.choice(keywords)) for _ in range(rng.randrange(1, 12))]
+        parts += [f"<p>{_text(rng, rng.randrange(50, 400))}</p>\n" for _ in range(rng.randrange(0, 5))]
+        rng.shuffle(parts)
+        split = rng.randrange(len(parts) + 1)
+        pages[f"mixed_{n}"] = _page("".join(parts[:split]), "".join(parts[split:])).encode("utf-8")
+    return pages
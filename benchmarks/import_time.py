@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import build_corpus  # noqa: E402
+from server import CorpusServer  # noqa: E402
+from signatures import load_registry  # noqa: E402
+
+
+# ============================================================
+# COLD START
+#
+# What a Catalyst cold start costs: each run is a fresh interpreter
+# that imports main.py and then serves one handler call (a small page
+# from a local CorpusServer). Three numbers per run:
+#
+#   process       interpreter start to exit, seen from outside
+#   import        `import main` alone
+#   first_call    the first handler() call after the import
+#
+#   python benchmarks/import_time.py                 # this tree
+#   python benchmarks/import_time.py --against HEAD~1 --repeat 20
+#
+# --against REV runs the same thing on a copy of the tree at a git
+# revision (via git archive), to show the difference a change made.
+# ============================================================
+
+# Runs in the fresh interpreter; the last line of its output is the result
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+class BasicIO:
+    def __init__(self, args):
+        self.args, self.out = args, []
+    def get_argument(self, name):
+        return self.args.get(name)
+    def write(self, data):
+        self.out.append(data)
+
+class Context:
+    def close(self):
+        pass
+
+io = BasicIO({"url": sys.argv[1]})
+main.handler(Context(), io)
+called = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_call": called - imported}))
+"""
+
+
+def run_once(tree, url):
+    env = dict(os.environ, SIGNALIQ_CACHE="")
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, "-c", CHILD, url], cwd=tree, env=env,
+                          capture_output=True, text=True, check=True)
+    process = time.perf_counter() - start
+    result = json.loads(done.stdout.strip().splitlines()[-1])
+    result["process"] = process
+    return result
+
+
+def measure(tree, url, repeat):
+    runs = [run_once(tree, url) for _ in range(repeat + 1)][1:]  # the first one warms the .pyc files
+    return {
+        name: {
+            "p50_ms": round(statistics.median(run[name] for run in runs) * 1000, 1),
+            "min_ms": round(min(run[name] for run in runs) * 1000, 1),
+        }
+        for name in ("process", "import", "first_call")
+    }
+
+
+def checkout(rev, into):
+    """Extract the tree at git revision rev into the directory into."""
+    archive = subprocess.run(["git", "archive", "--format=tar", rev], cwd=ROOT,
+                             capture_output=True, check=True).stdout
+    path = os.path.join(into, "tree.tar")
+    with open(path, "wb") as f:
+        f.write(archive)
+    with tarfile.open(path) as tar:
+        tar.extractall(into)
+    os.remove(path)
+    return into
+
+
+def report(label, result):
+    print(f"  {label}")
+    for name, values in result.items():
+        print(f"    {name:<11} p50 {values['p50_ms']:>8.1f} ms   min {values['min_ms']:>8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start of the Catalyst handler")
+    parser.add_argument("--repeat", type=int, default=10, help="fresh interpreters per tree (default 10)")
+    parser.add_argument("--against", help="also measure the tree at this git revision")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with CorpusServer(build_corpus(load_registry(), kinds=("small",))) as server:
+        url = server.url("small")
+        print(f"Cold start, {args.repeat} runs each")
+        results["current"] = measure(ROOT, url, args.repeat)
+        report("this tree", results["current"])
+        if args.against:
+            with tempfile.TemporaryDirectory() as tmp:
+                results[args.against] = measure(checkout(args.against, tmp), url, args.repeat)
+            report(args.against, results[args.against])
+
+    if args.against:
+        print("\n  change (p50)")
+        for name in ("process", "import", "first_call"):
+            before = results[args.against][name]["p50_ms"]
+            now = results["current"][name]["p50_ms"]
+            print(f"    {name:<11} {now - before:+8.1f} ms ({(now / before - 1) if before else 0:+.0%})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
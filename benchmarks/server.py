@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ============================================================
+# CORPUS SERVER
+#
+# A local stand-in for the sites we scan: serves the benchmark corpus
+# at http://127.0.0.1:<port>/<kind>, after `latency` seconds per
+# request (plus up to `jitter` more), so the fetch path can be measured
+# without the internet.
+# ============================================================
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The fetcher hangs up on pages past its size cap; that is expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class CorpusServer:
+    def __init__(self, pages, latency=0.0, jitter=0.0, port=0):
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, like real sites
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def do_GET(self):
+                server.requests += 1
+                page = server.pages.get(self.path.lstrip("/").split("?")[0])
+                delay = server.latency + (server.jitter * (hash(self.path) % 1000) / 1000)
+                if delay:
+                    time.sleep(delay)
+                if page is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = _QuietServer(("127.0.0.1", port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, kind):
+        return f"{self.base_url}/{kind}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="corpus-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
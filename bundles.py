@@ -0,0 +1,222 @@
+import hashlib
+import html
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from urllib.parse import urljoin, urlsplit
+
+from fetcher import HEADERS, get_session
+from singleflight import SingleFlight
+
+
+# ============================================================
+# SCRIPT FOLLOWING
+#
+# Plenty of sites load their pixels (Meta, TikTok, GA...) only from a
+# tag manager container or a theme bundle, so the page itself has no
+# trace of them and scores 0. With SIGNALIQ_FOLLOW_SCRIPTS=1 the
+# handler and the bulk scan also fetch the <script src> files a page
+# loads (up to MAX_SCRIPTS of them) and run the tag-scope signatures
+# over their code, as if it had been inline.
+#
+# The same bundle turns up on thousands of sites (a CDN copy of a
+# library, a platform's theme script), so BundleCache is shared by
+# every site in the process:
+#
+#   url -> content digest    each script URL is downloaded once
+#   digest -> detections     each distinct script body is scanned once,
+#                            even when it is served from many URLs
+#
+# Sites asking for a script that is already downloading wait for that
+# download. Failed downloads are remembered too, so a dead CDN is only
+# tried once. Following stops as soon as every tag signature is found,
+# and when the caller's time is up (the deadline follow_scripts gets):
+# a handler call never waits on scripts past its own page timeout.
+#
+# Both maps are LRU-bounded by BUNDLE_CACHE_ENTRIES, and no more than
+# SCRIPT_HOST_LIMIT scripts are downloaded from one host at a time, the
+# same per-host cap the bulk scan's scheduler puts on pages.
+# ============================================================
+
+FOLLOW_SCRIPTS = os.environ.get("SIGNALIQ_FOLLOW_SCRIPTS", "0") == "1"
+MAX_SCRIPTS = int(os.environ.get("SIGNALIQ_MAX_SCRIPTS", 10))
+SCRIPT_MAX_BYTES = 2 * 1024 * 1024
+SCRIPT_TIMEOUT = 5
+BUNDLE_CACHE_ENTRIES = 100_000
+SCRIPT_HOST_LIMIT = 2
+
+SCRIPT_SRC_PATTERN = re.compile(rb"""<script\b[^>]*?\ssrc\s*=\s*["']?([^"'\s>]+)""", re.IGNORECASE)
+
+
+def script_sources(body):
+    """The <script src> values of a page held in memory (bytes), in page order."""
+    return [html.unescape(src.decode("latin-1")) for src in SCRIPT_SRC_PATTERN.findall(body or b"")]
+
+
+def bundle_urls(page_url, srcs, limit=MAX_SCRIPTS):
+    """Absolute http(s) URLs of srcs (relative to page_url), each once, at most limit."""
+    urls = []
+    for src in srcs:
+        url = urljoin(page_url, src.strip()).split("#")[0]
+        if urlsplit(url).scheme in ("http", "https") and url not in urls:
+            urls.append(url)
+            if len(urls) >= limit:
+                break
+    return urls
+
+
+# What _download returns when the caller's deadline passed first
+_OUT_OF_TIME = object()
+
+
+class BundleCache:
+    def __init__(self, max_entries=BUNDLE_CACHE_ENTRIES, max_bytes=SCRIPT_MAX_BYTES, timeout=SCRIPT_TIMEOUT):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.stats = {"downloaded": 0, "url_hits": 0, "content_hits": 0, "failed": 0, "bytes": 0}
+        self._digests = OrderedDict()     # url -> content digest, or None if it could not be fetched
+        self._detections = OrderedDict()  # (digest, signature version) -> detection mask
+        self._downloads = SingleFlight()  # URLs being fetched and scanned
+        self._hosts = {}                  # host -> downloads in progress from it
+        self._lock = threading.Lock()
+        self._host_free = threading.Condition(self._lock)
+
+    def _download(self, url, deadline=None):
+        # The body, None if there is none to have, or _OUT_OF_TIME if the
+        # deadline came first (nothing is remembered about the URL then)
+        host = urlsplit(url).hostname
+        with self._lock:
+            while self._hosts.get(host, 0) >= SCRIPT_HOST_LIMIT:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return _OUT_OF_TIME
+                self._host_free.wait(left)
+            self._hosts[host] = self._hosts.get(host, 0) + 1
+        try:
+            return self._read(url, deadline)
+        finally:
+            with self._lock:
+                self._hosts[host] -= 1
+                if not self._hosts[host]:
+                    del self._hosts[host]
+                self._host_free.notify_all()
+
+    def _read(self, url, deadline):
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                return _OUT_OF_TIME
+        try:
+            response = get_session().get(url, headers=HEADERS, timeout=timeout, stream=True)
+        except Exception:
+            return None
+        try:
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            # An error page is not the script
+            if response.status_code != 200 or content_type == "text/html":
+                return None
+            chunks, read = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return _OUT_OF_TIME
+                chunks.append(chunk[:self.max_bytes - read])
+                read += len(chunks[-1])
+                if read >= self.max_bytes:
+                    break
+            return b"".join(chunks)
+        except Exception:
+            return None
+        finally:
+            response.close()
+
+    def detections(self, url, registry, deadline=None):
+        """Detection mask of the tag-scope signatures in the script at url (0 if it
+        could not be fetched, or not before deadline, a time.monotonic() value)."""
+        with self._lock:
+            if url in self._digests:
+                digest = self._digests[url]
+                mask = 0 if digest is None else self._detections.get((digest, registry.version))
+                if mask is not None:
+                    self._digests.move_to_end(url)
+                    if digest is not None:
+                        self._detections.move_to_end((digest, registry.version))
+                    self.stats["url_hits"] += 1
+                    return mask
+        try:
+            mask, _ = self._downloads.do(url, partial(self._fetch_and_scan, url, registry, deadline),
+                                         None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Another site's download of it is still going
+            return 0
+        return mask
+
+    def _fetch_and_scan(self, url, registry, deadline=None):
+        body = self._download(url, deadline)
+        if body is _OUT_OF_TIME:
+            return 0
+        digest = hashlib.blake2b(body, digest_size=16).digest() if body is not None else None
+        with self._lock:
+            self._digests[url] = digest
+            self._digests.move_to_end(url)
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+            if body is None:
+                self.stats["failed"] += 1
+                return 0
+            self.stats["downloaded"] += 1
+            self.stats["bytes"] += len(body)
+            mask = self._detections.get((digest, registry.version))
+            if mask is not None:
+                # A new URL, but a body we have scanned before
+                self._detections.move_to_end((digest, registry.version))
+                self.stats["content_hits"] += 1
+                return mask
+
+        mask = registry.detection_mask(registry.tag_matcher.scan(body))
+        with self._lock:
+            self._detections[(digest, registry.version)] = mask
+            while len(self._detections) > self.max_entries:
+                self._detections.popitem(last=False)
+        return mask
+
+
+_bundle_cache = None
+_bundle_cache_lock = threading.Lock()
+
+
+def get_bundle_cache():
+    """The process-wide BundleCache."""
+    global _bundle_cache
+    with _bundle_cache_lock:
+        if _bundle_cache is None:
+            _bundle_cache = BundleCache()
+        return _bundle_cache
+
+
+def follow_scripts(page_url, srcs, registry, found=(), limit=MAX_SCRIPTS, deadline=None):
+    """found plus the tag-scope signatures in the scripts page_url loads, in registry
+    order. Scripts not fetched by deadline (a time.monotonic() value) are skipped."""
+    cache = get_bundle_cache()
+    all_tags = registry.detection_mask(registry.tag_matcher.signatures)
+    mask = registry.detection_mask(found)
+    for url in bundle_urls(page_url, srcs, limit):
+        if mask & all_tags == all_tags:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        mask |= cache.detections(url, registry, deadline)
+    return registry.signatures_in(mask)
+
+
+def follow_document_scripts(document, registry, found=(), seconds=None):
+    """follow_scripts for the scripts of a fetched Document, timed as its
+    "scripts" stage, giving up after seconds."""
+    deadline = None if seconds is None else time.monotonic() + seconds
+    with document.timings.stage("scripts"):
+        return follow_scripts(document.final_url, document.script_srcs, registry, found, deadline=deadline)
@@ -0,0 +1,575 @@
+import codecs
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util import make_headers
+
+from latency import RETRY_STATUSES, get_latency_tracker, transient
+from metrics import Timings, collecting, current, get_metrics
+from metrics import install as install_metrics
+from redirect_cache import get_redirect_cache
+from resolver import install as install_resolver
+from response_cache import get_response_cache
+from signatures import load_registry
+
+
+# ============================================================
+# STREAMING FETCH
+#
+# Pages are read in chunks instead of being pulled into memory whole.
+# The signature scanner sees each chunk as it arrives, and we stop
+# reading as soon as every signature is decided or MAX_PAGE_BYTES have
+# been read. Responses that are not HTML are dropped right after the
+# headers arrive, before any of the body is downloaded.
+#
+# The scanner works on raw bytes. We never touch response.text, whose
+# charset sniffing (apparent_encoding) is slow on big pages; only
+# Document.text decodes, for callers that really want text.
+#
+# open_page goes through the on-disk ResponseCache (response_cache.py):
+# a fresh entry is served without any network I/O, a stale one is
+# revalidated, and a body read to the end (or to MAX_PAGE_BYTES) is
+# stored for next time.
+#
+# fetch_document opens pages through open_page_redirected, which skips
+# redirect chains it has walked before (redirect_cache.py).
+#
+# Requests that do go out (send_request) get timeouts fitted to how fast
+# the host has been so far, and optionally a hedged second request;
+# fetch_document retries transient failures (latency.py).
+# ============================================================
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+
+# ============================================================
+# SHARED SESSION
+#
+# Every HTTP call in the process (scanner, handler, agent tools, LLM
+# and license calls) goes through one requests.Session, so connections
+# are kept alive and reused instead of paying a new TCP + TLS handshake
+# per call. urllib3's connection pools are thread-safe, so the bulk
+# scan's worker threads all share it.
+#
+#   POOL_HOSTS     how many hosts keep a connection pool around
+#   POOL_PER_HOST  how many open connections each host's pool keeps
+# configure_pool() sets a different size for one host (e.g. the HF router).
+# ============================================================
+
+POOL_HOSTS = int(os.environ.get("SIGNALIQ_POOL_HOSTS", 100))
+POOL_PER_HOST = int(os.environ.get("SIGNALIQ_POOL_PER_HOST", 10))
+
+# Sent on every request unless the call overrides it. Accept-Encoding
+# lists br (and zstd) only when the decoder for it is installed.
+DEFAULT_HEADERS = {
+    **HEADERS,
+    'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding'],
+    'Connection': 'keep-alive',
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide pooled session (created on first use)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            # No cookie jar: cookies from one scanned site must not ride
+            # along to the next request (or to the LLM / license APIs),
+            # and a million-site scan would otherwise keep them all
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_PER_HOST)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # Host names are looked up through the DNS cache (resolver.py),
+            # and connection set-up is timed for metrics.py
+            install_resolver()
+            install_metrics()
+            _session = session
+        return _session
+
+
+def configure_pool(host, pool_size, scheme="https"):
+    """Give one host its own pool size, e.g. more connections to a busy API."""
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    get_session().mount(f"{scheme}://{host}/", adapter)
+
+
+def normalize_url(url):
+    """Canonical form of a URL, used as the cache key: scheme added, host lower-cased,
+    default port and fragment dropped."""
+    url = url.strip()
+    if not url.startswith('http'):
+        url = 'https://' + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        netloc += f":{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class CachedResponse:
+    """Stands in for a requests.Response whose body came out of the ResponseCache."""
+
+    status_code = 200
+    from_cache = True
+    cache_key = None
+    history = []
+
+    def __init__(self, entry):
+        self.url = entry.url
+        self.headers = CaseInsensitiveDict(entry.headers)
+        self.encoding = get_encoding_from_headers(self.headers)
+        self._body = entry.body
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        for start in range(0, len(self._body), chunk_size):
+            yield self._body[start:start + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Threads that carry hedged requests (both copies run on them)
+HEDGE_WORKERS = 64
+
+_hedge_pool = None
+_hedge_lock = threading.Lock()
+
+
+def _attempt(url, headers, timeouts):
+    # One GET, with its connection set-up timed into a Timings of its own:
+    # with hedging, two of them may be running for the same fetch
+    timings = Timings()
+    with collecting(timings):
+        # stream=True: only the headers are read here, the body waits for iter_body
+        response = get_session().get(url, headers=headers, timeout=timeouts, stream=True)
+    return response, timings
+
+
+def _close_loser(future):
+    if future.exception() is None:
+        future.result()[0].close()
+
+
+def _hedged(url, headers, timeouts, delay):
+    # The request, plus a second copy if the first has no headers after
+    # delay seconds; whichever answers first is used and the other closed
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+    first = _hedge_pool.submit(_attempt, url, headers, timeouts)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    tracker = get_latency_tracker()
+    tracker.count("hedged")
+    second = _hedge_pool.submit(_attempt, url, headers, timeouts)
+
+    pending, winner, error = {first, second}, None, None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+            elif winner is None:
+                winner = future
+            else:
+                future.result()[0].close()
+    for future in pending:
+        future.add_done_callback(_close_loser)
+    if winner is None:
+        raise error
+    if winner is second:
+        tracker.count("hedge_wins")
+    return winner.result()
+
+
+def send_request(url, headers=HEADERS, timeout=10):
+    """GET url (streamed) with connect/read timeouts fitted to the host's
+    latency so far, never longer than timeout (latency.py)."""
+    tracker = get_latency_tracker()
+    host = urlsplit(url).hostname or url
+    connect_timeout, read_timeout = tracker.timeouts(host, timeout)
+    metrics = get_metrics()
+    metrics.observe("signaliq_timeout_seconds", connect_timeout, help="Timeout given to each request",
+                    kind="connect")
+    metrics.observe("signaliq_timeout_seconds", read_timeout, help="Timeout given to each request", kind="read")
+
+    delay = tracker.hedge_delay(host)
+    start = time.perf_counter()
+    try:
+        if delay is None:
+            response, timings = _attempt(url, headers, (connect_timeout, read_timeout))
+        else:
+            response, timings = _hedged(url, headers, (connect_timeout, read_timeout), delay)
+    except requests.ConnectTimeout:
+        tracker.timed_out(host, connect=connect_timeout)
+        raise
+    except requests.Timeout:
+        tracker.timed_out(host, ttfb=read_timeout)
+        raise
+
+    setup = timings.get("dns") + timings.get("connect") + timings.get("tls")
+    tracker.observe(host, ttfb=max(0.0, time.perf_counter() - start - setup),
+                    connect=timings.get("connect") + timings.get("tls") if "connect" in timings.seconds else None)
+    # Hand the winning request's set-up times on to the caller's Timings
+    caller = current()
+    if caller is not None:
+        for stage, seconds in timings.seconds.items():
+            caller.add(stage, seconds)
+    return response
+
+
+def open_page(url, timeout=10, headers=HEADERS, use_cache=True):
+    cache = get_response_cache() if use_cache else None
+    if cache is None:
+        return send_request(url, headers, timeout)
+
+    key = normalize_url(url)
+    entry = cache.lookup(key)
+    if entry is not None and entry.fresh:
+        return CachedResponse(entry)
+
+    if entry is not None:
+        headers = dict(headers, **entry.conditional_headers())
+    response = send_request(url, headers, timeout)
+
+    if entry is not None:
+        if response.status_code == 304:
+            cache.revalidated(entry, response.headers)
+            response.close()
+            return CachedResponse(entry)
+        cache.changed(entry)
+
+    # iter_body stores the body under this key once it has been read
+    response.cache_key = key if response.status_code == 200 else None
+    return response
+
+
+def open_page_redirected(url, timeout=10, headers=HEADERS, use_cache=True):
+    """open_page, but straight to where url redirected to last time
+    (redirect_cache.py), walking the whole chain again only if that fails.
+    Returns (response, redirect chain with the final URL last).
+
+    Only a definite failure (status >= 400, or an error latency.transient
+    would not retry) forgets the cached chain. After a timeout or dropped
+    connection the chain is walked with whatever is left of timeout, and
+    the error is raised as is when too little is left."""
+    redirects = get_redirect_cache()
+    key = normalize_url(url)
+    known = redirects.lookup(key) if redirects else None
+    if known is not None:
+        started = time.monotonic()
+        try:
+            response = open_page(known.final_url, timeout, headers, use_cache)
+            if response.status_code < 400:
+                hops = [r.url for r in getattr(response, "history", [])]
+                chain = known.chain[:-1] + hops + [response.url]
+                if hops:
+                    # It moved again since
+                    redirects.store(key, chain)
+                return response, chain
+            response.close()
+            redirects.failed(key)
+        except requests.RequestException as e:
+            if not transient(e):
+                redirects.failed(key)
+            else:
+                timeout -= time.monotonic() - started
+                if timeout < get_latency_tracker().minimum:
+                    raise
+
+    response = open_page(url, timeout, headers, use_cache)
+    chain = [r.url for r in getattr(response, "history", [])] + [response.url]
+    if redirects and response.status_code < 400:
+        redirects.store(key, chain)
+    return response, chain
+
+
+def is_html(response):
+    content_type = response.headers.get("Content-Type", "")
+    # No Content-Type at all: assume HTML, like a browser would
+    return not content_type or content_type.split(";")[0].strip().lower() in HTML_TYPES
+
+
+def iter_body(response, max_bytes=MAX_PAGE_BYTES, chunk_size=CHUNK_SIZE):
+    """Yield the raw body in chunks, stopping after max_bytes. Closes the response."""
+    try:
+        if not is_html(response):
+            return
+        # Keep a copy for the cache, but only if we get to read it all: a
+        # body cut short because the caller had what it needed is not stored
+        cache_key = getattr(response, "cache_key", None)
+        kept = [] if cache_key else None
+        read = 0
+        for chunk in response.iter_content(chunk_size):
+            chunk = chunk[:max_bytes - read]
+            read += len(chunk)
+            if kept is not None:
+                kept.append(chunk)
+            yield chunk
+            if read >= max_bytes:
+                break
+        if kept is not None:
+            get_response_cache().store(cache_key, response.url, response.headers, b"".join(kept))
+    finally:
+        response.close()
+
+
+def text_decoder(response):
+    # Use the charset the server sent; without one, assume UTF-8 rather
+    # than letting requests guess
+    try:
+        return codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+# ============================================================
+# DOCUMENT
+#
+# A page is fetched ONCE into a Document, and every analyzer works
+# from that object instead of doing its own I/O: signature scoring
+# (filled in while the body streams), analyze_html (document.text),
+# the ScraperTool stack check and SSL inspection (document.peer_cert,
+# taken from the very TLS connection the page came over, whose peer
+# address also tells the bulk scan's scheduler which IP served it).
+#
+# document.timings holds how long each stage of the fetch took
+# (metrics.py); callers add their own parse / match stages to it.
+# ============================================================
+
+class Document:
+    def __init__(self, url):
+        self.url = url                 # what we were asked to fetch
+        self.final_url = url           # where the redirects ended up
+        self.redirects = [url]         # every URL on the way, final one last
+        self.status_code = None
+        self.headers = CaseInsensitiveDict()
+        self.encoding = None
+        self.body = None               # raw bytes, capped at max_bytes (None if not kept)
+        self.signatures = []           # registry signatures found in the body
+        self.script_srcs = []          # <script src> values, when the body was scanned
+        self.peer_cert = None          # getpeercert() of the TLS connection, if any
+        self.peer_ip = None            # the server's IP address (not known for cached pages)
+        self.from_cache = False
+        self.error = None              # the exception, if the fetch failed
+        self.timings = Timings()       # per-stage durations and bytes read (metrics.py)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def text(self):
+        """The body decoded with the charset the server declared (UTF-8 if none)."""
+        if self.body is None:
+            return ""
+        return text_decoder(self).decode(self.body, final=True)
+
+
+def peer_socket(response):
+    # The socket the body is about to be read from. It has to be grabbed
+    # before the body is read, while urllib3 still holds it.
+    raw = getattr(response, "raw", None)
+    conn = getattr(raw, "connection", None) or getattr(raw, "_connection", None)
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        # When the server closes the connection after this response,
+        # http.client lets go of it and the socket only lives on in the
+        # body stream
+        stream = getattr(getattr(raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(stream, "raw", None), "_sock", None)
+    return sock
+
+
+def peer_certificate(sock):
+    if sock is None or not hasattr(sock, "getpeercert"):
+        return None
+    try:
+        return sock.getpeercert()
+    except (OSError, ValueError):
+        return None
+
+
+def peer_address(sock):
+    try:
+        return sock.getpeername()[0] if sock is not None else None
+    except (OSError, AttributeError, IndexError):
+        return None
+
+
+def _fetch_once(document, scanner, url, timeout, headers, max_bytes, keep_body, use_cache):
+    # One attempt at the page: fill in document and feed the body to scanner
+    timings = document.timings
+
+    def set_up():
+        return timings.get("dns") + timings.get("connect") + timings.get("tls")
+
+    before = set_up()
+    with collecting(timings):
+        start = time.perf_counter()
+        response, document.redirects = open_page_redirected(url, timeout, headers, use_cache)
+    # Everything up to the headers that was not connection set-up
+    timings.add("ttfb", max(0.0, time.perf_counter() - start - (set_up() - before)))
+    document.status_code = response.status_code
+    document.headers = response.headers
+    document.encoding = response.encoding
+    document.final_url = response.url
+    document.from_cache = getattr(response, "from_cache", False)
+    if not document.from_cache:
+        sock = peer_socket(response)
+        document.peer_cert = peer_certificate(sock)
+        document.peer_ip = peer_address(sock)
+
+    kept = [] if keep_body else None
+    chunks = iter_body(response, max_bytes)
+    start = time.perf_counter()
+    matching = 0.0
+    try:
+        for chunk in chunks:
+            timings.bytes += len(chunk)
+            if scanner is not None:
+                scanned = time.perf_counter()
+                scanner.feed(chunk)
+                matching += time.perf_counter() - scanned
+            if kept is not None:
+                kept.append(chunk)
+            elif scanner is not None and scanner.done:
+                break
+        chunks.close()
+    finally:
+        timings.add("download", time.perf_counter() - start - matching)
+        if scanner is not None:
+            timings.add("match", matching)
+    if kept is not None:
+        document.body = b"".join(kept)
+
+
+def fetch_document(url, timeout=10, headers=HEADERS, registry=None, max_bytes=MAX_PAGE_BYTES,
+                   keep_body=True, use_cache=True, scan=True):
+    """Fetch url once and return a Document. Errors end up in document.error, not raised.
+
+    With keep_body=False only the signatures are wanted, so reading stops
+    as soon as every signature is decided. With scan=False the body is
+    only downloaded and document.signatures stays empty.
+
+    A timeout, a dropped connection or a 502/504 is tried again after a
+    jittered pause, up to SIGNALIQ_RETRIES times, each retry with a
+    shorter timeout (latency.retry_timeout). The first retry always
+    happens; later ones only while the first attempt started less than
+    timeout seconds ago.
+    """
+    document = Document(url)
+    registry = (registry or load_registry()) if scan else None
+    tracker = get_latency_tracker()
+    started = time.perf_counter()
+    attempts = 0
+    attempt_timeout = timeout
+    while True:
+        attempts += 1
+        scanner = registry.scanner() if scan else None
+        document.error = None
+        try:
+            _fetch_once(document, scanner, url, attempt_timeout, headers, max_bytes, keep_body, use_cache)
+        except Exception as e:
+            document.error = e
+        failed = transient(document.error) if document.error else document.status_code in RETRY_STATUSES
+        if not failed or attempts > tracker.retries:
+            break
+        pause = tracker.backoff(attempts)
+        if attempts > 1 and time.perf_counter() - started + pause >= timeout:
+            break
+        tracker.count("retries")
+        time.sleep(pause)
+        attempt_timeout = tracker.retry_timeout(timeout)
+    get_metrics().observe("signaliq_fetch_attempts", attempts, (1, 2, 3, 4, 5),
+                          help="Attempts per fetch, retries included")
+
+    if scanner is not None:
+        with document.timings.stage("match"):
+            document.signatures = scanner.close()
+        document.script_srcs = scanner.script_srcs
+    return document
+
+
+# Analyzers that ask for the same URL within this many seconds (e.g. the
+# agent's ScraperTool and SSLTool) share one Document
+RECENT_DOCUMENT_TTL = 60
+
+_recent_documents = {}
+_recent_lock = threading.Lock()
+
+
+def get_document(url, max_age=RECENT_DOCUMENT_TTL, **kwargs):
+    """Like fetch_document, but reuses a Document fetched for the same URL in the last max_age seconds."""
+    key = normalize_url(url)
+    now = time.time()
+    with _recent_lock:
+        recent = _recent_documents.get(key)
+        if recent and now - recent[0] < max_age:
+            return recent[1]
+
+    document = fetch_document(key, **kwargs)
+    with _recent_lock:
+        for old in [k for k, (at, _) in _recent_documents.items() if now - at >= max_age]:
+            del _recent_documents[old]
+        _recent_documents[key] = (now, document)
+    return document
+
+
+def scan_page(url, timeout=10, headers=HEADERS, registry=None, max_bytes=MAX_PAGE_BYTES):
+    """Just the signatures of url; raises if the fetch fails."""
+    document = fetch_document(url, timeout, headers, registry, max_bytes, keep_body=False)
+    if document.error:
+        raise document.error
+    return document.signatures
+
+
+def read_page(url, timeout=10, headers=HEADERS, max_bytes=MAX_PAGE_BYTES):
+    """The page as text; raises if the fetch fails."""
+    document = fetch_document(url, timeout, headers, max_bytes=max_bytes)
+    if document.error:
+        raise document.error
+    return document.text
+
+
+# A bulk-scan site's page and the scripts it loads share this many seconds
+SITE_TIMEOUT = 10
+
+
+def fetch_site(domain, **kwargs):
+    """fetch_document for one site of the bulk scan (https:// unless domain
+    says otherwise), with SITE_TIMEOUT seconds. Returns (url, document,
+    seconds of SITE_TIMEOUT the page left over for its scripts)."""
+    url = domain if domain.startswith('http') else 'https://' + domain
+    print(f"Scanning {url}...")
+    started = time.monotonic()
+    document = fetch_document(url, timeout=SITE_TIMEOUT, headers=HEADERS, **kwargs)
+    return url, document, max(0.0, SITE_TIMEOUT - (time.monotonic() - started))
@@ -0,0 +1,192 @@
+import os
+import random
+import threading
+from collections import OrderedDict, deque
+
+import requests
+from urllib3.exceptions import NameResolutionError
+
+from metrics import get_metrics
+
+
+# ============================================================
+# ADAPTIVE TIMEOUTS
+#
+# A fixed 10 s timeout is too long for the hosts that answer in 200 ms
+# (one stalled connection holds a worker for the full 10 s) and a single
+# slow attempt turns into an "Error:" row. LatencyTracker keeps, per
+# host, the last WINDOW connect times and header waits (TTFB) seen by
+# fetch_document, and from them:
+#
+#   timeouts(host, ceiling)  (connect, read) = TIMEOUT_FACTOR x their
+#                            p99, never below TIMEOUT_MIN nor above the
+#                            caller's timeout; hosts with fewer than
+#                            MIN_SAMPLES samples get the caller's timeout
+#   hedge_delay(host)        the host's p95 TTFB: a request still waiting
+#                            for headers after that long gets a second,
+#                            identical request, and the first answer wins
+#                            (off unless SIGNALIQ_HEDGE=1)
+#   backoff(attempt)         a jittered ("full jitter") pause before a
+#                            retry of a transient failure
+#   retry_timeout(timeout)   the (shorter) timeout a retry gets:
+#                            RETRY_TIMEOUT_SHARE of the caller's. The
+#                            first retry always happens, so a host we
+#                            know nothing about still gets a second try
+#                            after a slow first attempt
+#
+# A timed-out attempt is recorded as a sample of its timeout, so a host
+# that really is slow pushes its own timeouts back up instead of failing
+# every time.
+#
+# Timeouts, retries and hedges are counted in stats and, for
+# ?metrics= and --metrics, as signaliq_fetch_events_total{event=...}.
+#
+#   SIGNALIQ_ADAPTIVE_TIMEOUTS=0  use the callers' fixed timeouts
+#   SIGNALIQ_TIMEOUT_MIN          shortest adaptive timeout, seconds (1)
+#   SIGNALIQ_TIMEOUT_FACTOR       timeout = this x the host's p99 (3)
+#   SIGNALIQ_RETRIES              retries of a transient failure (2)
+#   SIGNALIQ_RETRY_BACKOFF        base of the retry backoff, seconds (0.25)
+#   SIGNALIQ_RETRY_TIMEOUT_SHARE  a retry's timeout, as a share of the caller's (0.5)
+#   SIGNALIQ_HEDGE=1              send hedged requests
+# ============================================================
+
+ADAPTIVE_TIMEOUTS = os.environ.get("SIGNALIQ_ADAPTIVE_TIMEOUTS", "1") != "0"
+TIMEOUT_MIN = float(os.environ.get("SIGNALIQ_TIMEOUT_MIN", 1))
+TIMEOUT_FACTOR = float(os.environ.get("SIGNALIQ_TIMEOUT_FACTOR", 3))
+RETRIES = int(os.environ.get("SIGNALIQ_RETRIES", 2))
+RETRY_BACKOFF = float(os.environ.get("SIGNALIQ_RETRY_BACKOFF", 0.25))
+RETRY_TIMEOUT_SHARE = float(os.environ.get("SIGNALIQ_RETRY_TIMEOUT_SHARE", 0.5))
+HEDGE = os.environ.get("SIGNALIQ_HEDGE", "0") == "1"
+
+WINDOW = 50
+MIN_SAMPLES = 5
+TIMEOUT_PERCENTILE = 99
+HEDGE_PERCENTILE = 95
+MAX_HOSTS = 10_000
+
+# Gateway errors are usually one bad backend behind a load balancer; 429
+# and 503 are the host asking us to slow down, which the scheduler handles
+RETRY_STATUSES = (502, 504)
+
+
+def percentile(samples, p):
+    """The p-th percentile (nearest rank) of samples."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def transient(error):
+    """Whether a failed request is worth trying again: a timeout or a dropped
+    connection, but not a host name that does not resolve, a certificate
+    that does not verify, a proxy failure or a URL that is not one."""
+    if isinstance(error, requests.Timeout):
+        return True
+    # All three are ConnectionErrors too, but trying again changes nothing
+    if isinstance(error, (requests.exceptions.SSLError, requests.exceptions.ProxyError,
+                          requests.exceptions.InvalidURL)):
+        return False
+    if not isinstance(error, requests.ConnectionError):
+        return False
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return not isinstance(reason, NameResolutionError)
+
+
+class _Samples:
+    __slots__ = ("connect", "ttfb")
+
+    def __init__(self):
+        self.connect = deque(maxlen=WINDOW)
+        self.ttfb = deque(maxlen=WINDOW)
+
+
+class LatencyTracker:
+    def __init__(self, adaptive=ADAPTIVE_TIMEOUTS, minimum=TIMEOUT_MIN, factor=TIMEOUT_FACTOR,
+                 retries=RETRIES, backoff_base=RETRY_BACKOFF, retry_share=RETRY_TIMEOUT_SHARE, hedge=HEDGE,
+                 max_hosts=MAX_HOSTS, rng=random.random):
+        self.adaptive = adaptive
+        self.minimum = minimum
+        self.factor = factor
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.retry_share = retry_share
+        self.hedge = hedge
+        self.max_hosts = max_hosts
+        self.rng = rng
+        self.stats = {"adaptive": 0, "timeouts": 0, "retries": 0, "hedged": 0, "hedge_wins": 0}
+        self._hosts = OrderedDict()   # host -> _Samples, least recently seen first
+        self._lock = threading.Lock()
+
+    def observe(self, host, ttfb=None, connect=None):
+        """Record one request to host: its header wait and, if a new connection
+        was opened, the connect time (seconds)."""
+        with self._lock:
+            samples = self._hosts.get(host)
+            if samples is None:
+                samples = self._hosts[host] = _Samples()
+                while len(self._hosts) > self.max_hosts:
+                    self._hosts.popitem(last=False)
+            self._hosts.move_to_end(host)
+            if ttfb is not None:
+                samples.ttfb.append(ttfb)
+            if connect is not None:
+                samples.connect.append(connect)
+
+    def timed_out(self, host, ttfb=None, connect=None):
+        # All we know is that it took at least this long
+        self.count("timeouts")
+        self.observe(host, ttfb, connect)
+
+    def _percentile(self, host, kind, p):
+        with self._lock:
+            samples = self._hosts.get(host)
+            values = list(getattr(samples, kind)) if samples else []
+        return percentile(values, p) if len(values) >= MIN_SAMPLES else None
+
+    def _bounded(self, p99, ceiling):
+        if p99 is None:
+            return ceiling
+        return min(ceiling, max(self.minimum, p99 * self.factor))
+
+    def timeouts(self, host, ceiling):
+        """(connect, read) timeouts for a request to host, at most ceiling each."""
+        if not self.adaptive:
+            return ceiling, ceiling
+        connect = self._bounded(self._percentile(host, "connect", TIMEOUT_PERCENTILE), ceiling)
+        read = self._bounded(self._percentile(host, "ttfb", TIMEOUT_PERCENTILE), ceiling)
+        if (connect, read) != (ceiling, ceiling):
+            self.count("adaptive")
+        return connect, read
+
+    def hedge_delay(self, host):
+        """Seconds to wait for headers before hedging, or None (hedging off, or
+        too little known about host)."""
+        if not self.hedge:
+            return None
+        return self._percentile(host, "ttfb", HEDGE_PERCENTILE)
+
+    def backoff(self, attempt):
+        """Seconds to sleep before retry number attempt (1, 2, ...)."""
+        return self.rng() * self.backoff_base * 2 ** (attempt - 1)
+
+    def retry_timeout(self, timeout):
+        """The timeout (before adapting to the host) for a retry of a fetch given timeout."""
+        return min(timeout, max(self.minimum, timeout * self.retry_share))
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+        get_metrics().count("signaliq_fetch_events_total", help="Timeouts, retries and hedges of fetches",
+                            event=stat)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker():
+    """The process-wide LatencyTracker."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = LatencyTracker()
+        return _tracker
@@ -1,23 +1,58 @@
-import re
-import requests
+import importlib
 import json
-from bs4 import BeautifulSoup
-import csv
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bundles import FOLLOW_SCRIPTS, follow_document_scripts
+from fetcher import HEADERS, Document, fetch_document, get_session, normalize_url, read_page
+from metrics import METRICS_IN_ROWS, get_metrics, stage_summary
+from resolver import get_resolver
+from result_cache import get_result_cache
+from results import ScanResult
+from scheduler import host_of
+from signatures import load_registry
 
 
 # --- 1. CONFIGURATION ---
 
-# We define HEADERS here so the script looks like a real browser (Chrome)
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-}
-
-tech_signatures = {
-    "TikTok Ads":      {"pattern": r"analytics\.tiktok\.com|tiktok-pixel", "points": 15},
-    "Meta Ads":        {"pattern": r"connect\.facebook\.net|fbevents\.js|fbq\(", "points": 10},
-    "Google Analytics":{"pattern": r"googletagmanager\.com|ua-\d+|gtag\(", "points": 5},
-    "Shopify":         {"pattern": r"myshopify\.com|shopify\.cdn", "points": 20}
-}
+# HEADERS (in fetcher.py) make the script look like a real browser (Chrome).
+# Pages are streamed and capped at fetcher.MAX_PAGE_BYTES.
+
+# Importing this module is the Catalyst function's cold start, so it
+# only does what every handler call needs anyway:
+#   - signatures.json is parsed and every matcher regex compiled here,
+#     not on the first page
+#   - the pooled session is created here; the container keeps the module
+#     (and its open connections) alive between invocations
+#   - nothing else runs: the mock demo is demo(), and the bulk scan
+#     (scanner.py with its process pool, store.py with SQLite) is only
+#     imported when it is used
+registry = load_registry().precompile()
+get_session()
+
+# batch_handler: how many sites one invocation scans at once, and how
+# long it may take when Catalyst does not say (the function's remaining
+# time is used when it does, minus a margin for writing the answer)
+BATCH_CONCURRENCY = int(os.environ.get("SIGNALIQ_BATCH_CONCURRENCY", 10))
+BATCH_BUDGET = float(os.environ.get("SIGNALIQ_BATCH_BUDGET", 25))
+BATCH_MARGIN = float(os.environ.get("SIGNALIQ_BATCH_MARGIN", 2))
+PAGE_TIMEOUT = 5
+
+# Bulk scan settings (concurrency, per-host limit, flush batch) live in scanner.py
+_LAZY = {"run_scan": "scanner", "scan_website": "scanner", "scan_websites": "scanner"}
+
+
+def __getattr__(name):
+    # main.run_scan and friends still work; scanner.py loads on first use
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
 def get_website_content(url):
     # Auto-add https:// if the user forgot it
     if not url.startswith('http'):
@@ -27,115 +62,91 @@ def get_website_content(url):
     
     try:
         # We pass the HEADERS dictionary here
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        return response.text
+        return read_page(url, timeout=10, headers=HEADERS)
     except Exception as e:
         return f"Error: {e}"
 
-def analyze_target(url):
+def analyze_target(url, timeout=PAGE_TIMEOUT, follow=FOLLOW_SCRIPTS):
     # 1. Clean the URL
     if not url.startswith('http'):
         url = 'https://' + url
 
+    # 2. Visit the website ONCE and 3. scan for "Rich Signals" as the page
+    #    streams in (one pass, stops early once everything is decided)
+    deadline = time.monotonic() + timeout
+    document = fetch_document(url, timeout=timeout, headers=HEADERS, registry=registry, keep_body=False)
+
+    # 3b. Optionally scan the scripts it loads too (pixels that only come
+    #     in through a tag manager), see bundles.py; all within timeout
+    if follow and document.ok:
+        document.signatures = follow_document_scripts(document, registry, document.signatures,
+                                                      deadline - time.monotonic())
+
+    # Per-stage timings go to metrics.py (and into the result if asked for)
+    get_metrics().record(document.timings, "handler")
+    timings = document.timings if METRICS_IN_ROWS else None
+    if document.error:
+        return ScanResult(url, error=str(document.error), timings=timings).to_target()
+
+    signals_found, score = analyze_html(document, base_score=10) # Base score of 10, capped at 100
+
+    print(f"Found: {signals_found}")
+    print(f"Total Score: {score}")
+
+    # Same shape as always: {"status", "url", "wealth_score", "tech_stack", "signature_version"},
+    # plus the page's HTTP status (a 429 or 5xx page still "succeeds")
+    result = ScanResult.from_signatures(url, document.signatures, score, registry, timings=timings).to_target(registry)
+    result["http_status"] = document.status_code
+    return result
+
+def cached_target(url, timeout=PAGE_TIMEOUT):
+    # analyze_target through the in-memory result cache (result_cache.py):
+    # repeat calls for a site get the last result, refreshed in the
+    # background once it goes stale, and only successes from a 2xx page are kept
+    cache = get_result_cache()
     try:
-        # 2. Visit the website
-        response = requests.get(url, headers=HEADERS, timeout=5)
-        page_content = response.text.lower()
-
-        # 3. Scan for "Rich Signals"
-        signals_found = []
-        score = 10 # Base score
-
-        # SIGNAL 1: Facebook Pixel (Ads)
-        if 'fbevents.js' in page_content or 'facebook.com/tr' in page_content:
-            signals_found.append("Facebook Pixel")
-            score += 25
-
-        # SIGNAL 2: Google Tag Manager (Data)
-        if 'gtm.js' in page_content or 'googletagmanager' in page_content:
-            signals_found.append("GTM")
-            score += 10
-
-        # SIGNAL 3: HubSpot (Premium CRM)
-        if 'hubspot.js' in page_content or 'hs-scripts.com' in page_content:
-            signals_found.append("HubSpot")
-            score += 30
-
-        # SIGNAL 4: Shopify (E-commerce)
-        if 'shopify' in page_content:
-            signals_found.append("Shopify Store")
-            score += 20
-
-        # SIGNAL 5: Security
-        if 'recaptcha' in page_content:
-            signals_found.append("Google Security")
-            score += 5
-        keywords = ['tiktok.com', 'tiktok-pixel']
-
-        if any(keyword in page_content for keyword in keywords):
-            signals_found.append("TikTok Ads")
-            score += 15
-        # Check for Meta (Facebook) Pixel
-        if any(x in page_content for x in ['fbevents.js', 'fbq(', 'facebook.net']):
-            signals_found.append("Meta Ads")
-            score += 10
-
-        # Check for Google Analytics/Ads (GTM or gtag)
-        if any(x in page_content for x in ['googletagmanager.com', 'gtag(', 'ua-']):
-            signals_found.append("Google Ads/Analytics")
-            score += 5
-        # Configuration: Define the tech, keywords to look for, and the score value
-        tech_signatures = {
-            "TikTok Ads": {"keywords": ['tiktok.com', 'tiktok-pixel'], "points": 15},
-            "Meta Ads":   {"keywords": ['fbevents.js', 'fbq('],        "points": 10},
-            "Google Ads": {"keywords": ['googletagmanager', 'gtag('],   "points": 5},
-            "Shopify":    {"keywords": ['myshopify.com', 'shopify.CHECKOUT'], "points": 20}
-        }
-
-        # The Logic Loop
-        for tech, data in tech_signatures.items():
-            # Check if ANY of the keywords exist in the page content
-            if any(k in page_content for k in data["keywords"]):
-                signals_found.append(tech)
-                score += data["points"]
-
-        print(f"Found: {signals_found}")
-        print(f"Total Score: {score}")
-        # Cap score at 100
-        if score > 100: score = 100
-
-        return {
-            "status": "success",
-            "url": url,
-            "wealth_score": score,
-            "tech_stack": signals_found
-        }
+        key = (normalize_url(url), registry.version) if cache is not None else None
+    except ValueError:
+        # Not a URL we can key on (bad port, unclosed [): analyze_target
+        # turns it into the usual error result
+        key = None
+    if key is None:
+        return analyze_target(url, timeout)
+    result = cache.get(key,
+                       lambda: analyze_target(url, timeout),
+                       refresh=lambda: analyze_target(url),
+                       keep=lambda result: result.get("status") == "success"
+                       and 200 <= (result.get("http_status") or 0) < 300)
+    # A copy, so callers can add to it without touching the cached one
+    return dict(result)
+
+def analyze_html(html_content, base_score=0):
+    # 1. Find every signature (script/link tags or whole page, per its scope).
+    #    A fetched Document was already scanned while it downloaded.
+    if isinstance(html_content, Document):
+        found = html_content.signatures
+    else:
+        found = registry.detect(html_content)
+
+    # 2. Collect the NAMES and add up the SCORE
+    found_signals = [sig["name"] for sig in found]
+    total_score = registry.score(found, base=base_score)
 
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": str(e)
-        }
-def analyze_html(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # 1. Get the raw code from script and link tags
-    tags_to_scan = soup.find_all(['script', 'link'])
-    raw_code = " ".join(map(str, tags_to_scan))
-    
-    found_signals = []
-    total_score = 0
-    
-    # 2. Run ONE loop to do both jobs (Populate List + Add Score)
-    for tech, data in tech_signatures.items():
-        if re.search(data["pattern"], raw_code, re.IGNORECASE):
-            found_signals.append(tech)        # Save the NAME
-            total_score += data["points"]     # Add the SCORE
-            
     return found_signals, total_score
 
 # --- THE GATEWAY: Zoho Catalyst Handler ---
 def handler(context, basicio):
+    # ?metrics=json (or =prometheus) returns the stage timings collected so far
+    try:
+        metrics_format = basicio.get_argument("metrics")
+    except:
+        metrics_format = None
+    if metrics_format:
+        metrics = get_metrics()
+        basicio.write(metrics.prometheus() if metrics_format == "prometheus" else json.dumps(metrics.snapshot()))
+        context.close()
+        return
+
     try:
         target_url = basicio.get_argument("url") 
     except:
@@ -143,9 +154,120 @@ def handler(context, basicio):
         context.close()
         return
 
-    result_data = analyze_target(target_url)
+    with get_metrics().timed("handler"):
+        result_data = cached_target(target_url)
     basicio.write(json.dumps(result_data))
     context.close()
+
+
+# --- THE BATCH GATEWAY ---
+# One invocation, many sites: `urls` is a list, or a string with one URL
+# per line (commas work too). They are scanned BATCH_CONCURRENCY at a
+# time and every result is written as one JSON line the moment it is
+# ready, each carrying its "url". Whatever has not finished when the time
+# budget runs out is written as {"status": "partial", "url": ...}, so
+# the caller can send those again.
+
+def batch_urls(value):
+    """The URLs in a batch_handler `urls` argument (list, JSON array or lines of text)."""
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("["):
+            value = json.loads(text)
+        else:
+            value = text.replace(",", "\n").splitlines()
+    urls = [str(url).strip() for url in value or []]
+    return [url for url in urls if url and not url.startswith("#")]
+
+
+def batch_budget(context, budget=None):
+    """Seconds this invocation may spend scanning."""
+    remaining = getattr(context, "get_remaining_execution_time_ms", None)
+    seconds = remaining() / 1000 - BATCH_MARGIN if remaining else BATCH_BUDGET
+    if budget:
+        seconds = min(seconds, float(budget))
+    return max(0.0, seconds)
+
+
+def scan_batch(urls, budget, concurrency=BATCH_CONCURRENCY):
+    """Yield analyze_target results as they finish, then a "partial" one for
+    every URL that did not finish within budget seconds."""
+    deadline = time.monotonic() + budget
+    hosts = {}
+    for url in urls:
+        try:
+            hosts[url] = host_of(url)
+        except ValueError as e:
+            # Not a URL at all (bad port, unclosed [): reported on its own line
+            yield {"status": "error", "url": url, "message": str(e)}
+    urls = [url for url in urls if url in hosts]
+    resolver = get_resolver()
+    if resolver:
+        resolver.prefetch(hosts.values())
+
+    def scan(url):
+        # Never wait on a page longer than the batch has left
+        timeout = min(PAGE_TIMEOUT, max(0.5, deadline - time.monotonic()))
+        result = cached_target(url, timeout=timeout)
+        result.setdefault("url", url)
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    pending = {pool.submit(scan, url): url for url in urls}
+    try:
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            done, _ = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {"status": "error", "url": url, "message": str(e)}
+        for url in pending.values():
+            yield {"status": "partial", "url": url, "message": "Not finished before the deadline"}
+    finally:
+        # Anything still running is abandoned: its thread finishes on its
+        # own (page timeouts are capped by the deadline) and is dropped
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_handler(context, basicio):
+    try:
+        urls = batch_urls(basicio.get_argument("urls"))
+    except:
+        urls = []
+    if not urls:
+        basicio.write(json.dumps({"error": "No URLs provided"}) + "\n")
+        context.close()
+        return
+
+    def argument(name):
+        try:
+            return basicio.get_argument(name)
+        except:
+            return None
+
+    try:
+        concurrency = int(argument("concurrency") or BATCH_CONCURRENCY)
+        budget = float(argument("budget") or 0)
+        if not math.isfinite(budget):
+            raise ValueError(budget)
+    except (TypeError, ValueError):
+        basicio.write(json.dumps({"error": "concurrency and budget must be numbers"}) + "\n")
+        context.close()
+        return
+
+    try:
+        with get_metrics().timed("batch_handler"):
+            for result in scan_batch(urls, batch_budget(context, budget), concurrency):
+                basicio.write(json.dumps(result) + "\n")
+    finally:
+        context.close()
+
+
 # This simulates a website that uses Shopify and Facebook, 
 # but simply writes about TikTok (False positive test)
 mock_website_html = """
@@ -169,62 +291,96 @@ mock_website_html = """
 </html>
 """
 
-# Run the analyzer
-signals, score = analyze_html(mock_website_html)
 
-# --- 4. OUTPUT ---
-print("-" * 30)
-print(f"Signals Detected: {signals}")
-print(f"Lead Score:       {score}")
-print("-" * 30)
+def demo():
+    # Run the analyzer
+    signals, score = analyze_html(mock_website_html)
+
+    # --- 4. OUTPUT ---
+    print("-" * 30)
+    print(f"Signals Detected: {signals}")
+    print(f"Lead Score:       {score}")
+    print("-" * 30)
 
 # ... (Your imports and functions are above this) ...
 
 # --- 3. MAIN EXECUTION BLOCK ---
 if __name__ == "__main__":
+    from latency import get_latency_tracker
+    from redirect_cache import get_redirect_cache
+    from response_cache import get_response_cache
+    from scanner import run_scan
+    from store import STORE_PATH, ResultStore
 
-    # The list of websites to scan (You can eventually load this from a file)
-    target_websites = [
-        "allbirds.com",
-        "gymshark.com", 
-        "colourpop.com",
-        "zoho.com",      # Will likely score 0 (Protected/Dynamic)
-        "tesla.com"
-    ]
+    demo()
 
-    print(f"\n--- STARTING BULK SCAN ({len(target_websites)} sites) ---\n")
-    
-    # We will store all results here
-    results_database = []
+    # Usage: python main.py [domains.txt | domains.csv] [results.sqlite | output.csv] [--fresh]
+    #                       [--metrics metrics.prom | metrics.json]
+    # A domains file is streamed, never loaded whole, and an interrupted
+    # run picks up where it stopped when started again (--fresh starts over)
+    args = sys.argv[1:]
+    metrics_path = None
+    if "--metrics" in args:
+        at = args.index("--metrics")
+        metrics_path = args[at + 1] if at + 1 < len(args) else "metrics.prom"
+        del args[at:at + 2]
+    fresh = "--fresh" in args
+    args = [arg for arg in args if arg != "--fresh"]
 
-    for url in target_websites:
-        # Clean the URL
-        if not url.startswith('http'):
-            clean_url = 'https://' + url
-        else:
-            clean_url = url
+    if args:
+        target_websites = args[0]
+    else:
+        # The built-in demo list, rescanned from scratch every time
+        target_websites = [
+            "allbirds.com",
+            "gymshark.com", 
+            "colourpop.com",
+            "zoho.com",      # Will likely score 0 (Protected/Dynamic)
+            "tesla.com"
+        ]
+        fresh = True
 
-        print(f"Scanning {clean_url}...")
-        
-        # 1. Fetch & Analyze
-        html = get_website_content(clean_url)
-        signals, score = analyze_html(html)
-        
-        # 2. Add to our database list
-        results_database.append({
-            "URL": clean_url,
-            "Score": score,
-            "Tech Stack": ", ".join(signals) # Converts list to string "Meta, Shopify"
-        })
-
-    # --- 4. SAVE TO CSV ---
+    # --- 4. SAVE (row by row, as each site finishes) ---
+    # Results go into the SQLite store (store.py); scan_results.csv is
+    # still written from it for anything that reads the old file
+    output = args[1] if len(args) > 1 else STORE_PATH
     csv_filename = "scan_results.csv"
-    
-    # Writing the file
-    with open(csv_filename, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=["URL", "Score", "Tech Stack"])
-        writer.writeheader()
-        writer.writerows(results_database)
-
-    print(f"\n[SUCCESS] Scanned {len(target_websites)} sites.")
-    print(f"Results saved to: {csv_filename}")
+
+    label = target_websites if args else f"{len(target_websites)} sites"
+    print(f"\n--- STARTING BULK SCAN ({label}) ---\n")
+
+    scanned = run_scan(target_websites, output, fresh=fresh)
+
+    print(f"\n[SUCCESS] Scanned {scanned} sites.")
+    if output.lower().endswith(".csv"):
+        print(f"Results saved to: {output}")
+    else:
+        store = ResultStore(output)
+        store.export_csv(csv_filename)
+        print(f"Results saved to: {output} (exported to {csv_filename})")
+        print("Top leads:")
+        for lead in store.top_by_score(5, min_score=1):
+            print(f"  {lead['score']:>3}  {lead['domain']}  {lead['tech_stack']}")
+        store.close()
+
+    # Pages fetched recently come out of the on-disk cache (or cost a 304)
+    cache = get_response_cache()
+    if cache:
+        print(f"Cache: {cache.stats['hits']} hits, {cache.stats['revalidated']} revalidated, "
+              f"{cache.stats['misses']} misses")
+    # Redirect chains walked on an earlier run are skipped
+    redirects = get_redirect_cache()
+    if redirects:
+        print(f"Redirects: {redirects.stats['hits']} chains skipped, {redirects.stats['fallbacks']} walked again")
+    # Slow attempts cut short and tried again, hedges sent (latency.py)
+    latency = get_latency_tracker().stats
+    print(f"Latency: {latency['timeouts']} timeouts, {latency['retries']} retries, "
+          f"{latency['hedged']} hedged ({latency['hedge_wins']} won)")
+
+    # Where the time went, on average per site (metrics.py)
+    summary = stage_summary("bulk")
+    if summary:
+        print(f"Stage time (ms): {summary}")
+    if metrics_path:
+        get_metrics().write(metrics_path)
+        print(f"Metrics saved to: {metrics_path}")
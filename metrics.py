@@ -0,0 +1,292 @@
+import json
+import os
+import ssl
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import urllib3.connection
+
+
+# ============================================================
+# STAGE METRICS
+#
+# Where does a slow scan spend its time? Every fetch_document call
+# carries a Timings that collects, per stage:
+#
+#   dns       looking the host up (resolver.py's create_connection hook)
+#   connect   the TCP handshake
+#   tls       the TLS handshake (HTTPSConnection.connect minus the above)
+#   ttfb      from the request going out to the response headers
+#   download  reading the body (minus the time spent matching it)
+#   parse     decoding / fingerprinting the body, where a caller does that
+#   match     the signature scan
+#   scripts   following the page's <script src> bundles (bundles.py)
+#
+# plus the bytes read. dns, connect and tls only show up when a new
+# connection was opened; a kept-alive one skips them.
+#
+# Callers hand finished Timings to the process-wide Metrics with a
+# source label ("bulk", "handler", "ssl_tool", "scraper_tool"), which
+# keeps them as histograms. snapshot() gives them as a dict (JSON) and
+# prometheus() in the Prometheus text format. fetcher.py adds the
+# timeouts it hands out (signaliq_timeout_seconds) and the attempts each
+# fetch took (signaliq_fetch_attempts), and latency.py counts timeouts,
+# retries and hedges (signaliq_fetch_events_total, a counter).
+#
+#   SIGNALIQ_METRICS=0          stop recording
+#   SIGNALIQ_METRICS_IN_ROWS=1  also put each site's timings on its
+#                               result row (CSV columns, handler JSON)
+# ============================================================
+
+METRICS = os.environ.get("SIGNALIQ_METRICS", "1") != "0"
+METRICS_IN_ROWS = os.environ.get("SIGNALIQ_METRICS_IN_ROWS", "0") == "1"
+
+STAGES = ("dns", "connect", "tls", "ttfb", "download", "parse", "match", "scripts")
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(8))   # 1 KiB .. 16 MiB
+
+# Column names when timings are attached to a result row
+TIMING_COLUMNS = ["DNS ms", "Connect ms", "TLS ms", "TTFB ms", "Download ms", "Parse ms", "Match ms", "Scripts ms",
+                  "Bytes"]
+
+
+class Timings:
+    """Stage durations (seconds) and bytes read for one fetch."""
+
+    __slots__ = ("seconds", "bytes", "recorded")
+
+    def __init__(self):
+        self.seconds = {}
+        self.bytes = 0
+        self.recorded = False
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def get(self, stage):
+        return self.seconds.get(stage, 0.0)
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def as_dict(self):
+        """{"dns_ms": ..., "bytes": ...} for the handler's JSON."""
+        result = {f"{stage}_ms": round(self.seconds[stage] * 1000, 1) for stage in STAGES if stage in self.seconds}
+        result["bytes"] = self.bytes
+        return result
+
+    def as_row(self):
+        """The TIMING_COLUMNS of a result row (blank where a stage did not happen)."""
+        values = [round(self.seconds[stage] * 1000, 1) if stage in self.seconds else "" for stage in STAGES]
+        return dict(zip(TIMING_COLUMNS, values + [self.bytes]))
+
+
+# The Timings of the fetch running on this thread, for the connection
+# hooks, which cannot be handed one
+_local = threading.local()
+
+
+def current():
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def collecting(timings):
+    """Make timings the current thread's Timings for the duration."""
+    previous = current()
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # (name, sorted label pairs) -> Histogram
+        self._counters = {}     # (name, sorted label pairs) -> count
+        self._help = {}
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, help="", **labels):
+        if not METRICS:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help)
+            histogram.observe(value)
+
+    def count(self, name, amount=1, help="", **labels):
+        if not METRICS:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, help)
+
+    def record(self, timings, source):
+        """Add one fetch's Timings under source. A Timings is only counted once,
+        however many callers share its Document."""
+        if timings is None or timings.recorded:
+            return
+        timings.recorded = True
+        for stage in STAGES:
+            if stage in timings.seconds:
+                self.observe("signaliq_stage_seconds", timings.seconds[stage],
+                             help="Time spent in each fetch/analyze stage", stage=stage, source=source)
+        self.observe("signaliq_fetch_bytes", timings.bytes, BYTES_BUCKETS,
+                     help="Body bytes read per fetch", source=source)
+
+    @contextmanager
+    def timed(self, source):
+        """Observe the whole of a request (handler call, agent tool run) under source."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("signaliq_request_seconds", time.perf_counter() - start,
+                         help="Time per handler call or tool run", source=source)
+
+    def mean(self, name, **labels):
+        """Mean of the observations of one histogram, or None if it has none."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            return histogram.sum / histogram.count if histogram and histogram.count else None
+
+    def snapshot(self):
+        """{name: [{"labels", "count", "sum", "buckets": {le: cumulative count}}]}
+        for histograms, {name: [{"labels", "value"}]} for counters"""
+        result = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                result.setdefault(name, []).append({
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "buckets": {str(bound): total for bound, total in histogram.cumulative()},
+                })
+        return result
+
+    def prometheus(self):
+        """The counters and histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), total in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                    lines.append(f"# TYPE {name} counter")
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                lines.append(f"{name}{{{label_text}}} {total}" if label_text else f"{name} {total}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                    lines.append(f"# TYPE {name} histogram")
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                for bound, total in histogram.cumulative():
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{{{label_text + ',' if label_text else ''}{le}}} {total}")
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Save a snapshot: JSON for a .json path, Prometheus text otherwise."""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                json.dump(self.snapshot(), f, indent=2)
+            else:
+                f.write(self.prometheus())
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The process-wide Metrics."""
+    return _metrics
+
+
+def stage_summary(source):
+    """Mean ms per stage for source, as "dns 3.1, connect 12.0, ..." (stages seen only)."""
+    parts = []
+    for stage in STAGES:
+        mean = _metrics.mean("signaliq_stage_seconds", stage=stage, source=source)
+        if mean is not None:
+            parts.append(f"{stage} {mean * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- TLS handshake timing ---
+
+_original_https_connect = urllib3.connection.HTTPSConnection.connect
+
+
+def _timed_https_connect(self):
+    timings = current()
+    if timings is None:
+        return _original_https_connect(self)
+    before = timings.get("dns") + timings.get("connect")
+    start = time.perf_counter()
+
+    def handshake():
+        # Whatever connect() spent beyond the DNS lookup and the TCP
+        # handshake (both timed by the create_connection hook) is TLS
+        tcp = timings.get("dns") + timings.get("connect") - before
+        timings.add("tls", max(0.0, time.perf_counter() - start - tcp))
+
+    try:
+        result = _original_https_connect(self)
+    except ssl.SSLError:
+        # The handshake itself failed (a failed lookup or connect never got to it)
+        handshake()
+        raise
+    handshake()
+    return result
+
+
+def install():
+    """Time TLS handshakes of urllib3's HTTPS connections (safe to call more than once)."""
+    urllib3.connection.HTTPSConnection.connect = _timed_https_connect
@@ -0,0 +1,229 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+from bundles import FOLLOW_SCRIPTS, follow_document_scripts, script_sources
+from fetcher import fetch_site
+from resolver import prefetch_stream
+from results import ScanResult
+from scheduler import dispatch, host_of
+from signatures import load_registry, tag_fingerprint
+
+
+# ============================================================
+# STAGED PIPELINE
+#
+# Fetching is I/O and scales with threads, but the signature pass is
+# pure Python and the GIL keeps it on one core however many threads
+# run it. The bulk scan is therefore split into stages:
+#
+#   resolve   prefetch_stream looks up hosts ahead of the fetchers
+#   fetch     the scheduler's thread pool downloads bodies (no scanning)
+#   analyze   a process pool, one worker per core, runs tag_fingerprint
+#             and registry.detect on each body
+#   scripts   with SIGNALIQ_FOLLOW_SCRIPTS=1, a thread pool fetches the
+#             scripts of the pages analysis did not reuse (bundles.py)
+#   write     the caller gets (item, ScanResult) pairs as they finish
+#
+# Fetched bodies wait in a bounded queue (ANALYZE_QUEUE) and at most
+# two bodies per analysis worker are out at once. When analysis falls
+# behind, the fetchers block on the queue and stop fetching, so memory
+# stays bounded however long the input is.
+#
+# Bodies of SHARED_MEMORY_MIN bytes or more go to the workers through
+# shared memory instead of being pickled down a pipe. A worker
+# fingerprints the page in place, and only copies the body out when it
+# actually has to scan it (the page changed since the last scan).
+# ============================================================
+
+ANALYZE_WORKERS = int(os.environ.get("SIGNALIQ_ANALYZE_WORKERS", os.cpu_count() or 1))
+ANALYZE_QUEUE = int(os.environ.get("SIGNALIQ_ANALYZE_QUEUE", 64))
+SHARED_MEMORY_MIN = 64 * 1024
+
+_DONE = object()
+
+
+# --- the analysis worker (runs in the pool's processes) ---
+
+_worker_registry = None
+
+
+def _init_worker(registry_path):
+    global _worker_registry
+    _worker_registry = load_registry(registry_path)
+
+
+def analyze_body(body, shm_name, size, old_fingerprint, old_mask, want_fingerprint):
+    """Scan one body in a pool worker. body is the page itself, or None when it
+    is in the shared memory block shm_name. Returns (mask, score, fingerprint,
+    parse_seconds, match_seconds, reused); reused is True when the fingerprint
+    matched old_fingerprint, and only the body-scope signatures were matched
+    (the tag-scope ones come from old_mask)."""
+    registry = _worker_registry
+    shm = shared_memory.SharedMemory(name=shm_name) if body is None else None
+    try:
+        view = shm.buf[:size] if shm is not None else body
+        start = time.perf_counter()
+        fingerprint = tag_fingerprint(view) if want_fingerprint else None
+        parsed = time.perf_counter()
+        reused = bool(fingerprint) and fingerprint == old_fingerprint
+        if reused:
+            found = registry.detect_with_tags(bytes(view), old_mask)
+        else:
+            found = registry.detect(bytes(view))
+        return (registry.detection_mask(found), registry.score(found), fingerprint,
+                parsed - start, time.perf_counter() - parsed, reused)
+    finally:
+        if shm is not None:
+            view.release()
+            shm.close()
+
+
+# --- the parent side ---
+
+class _Handoff:
+    # One body on its way to a worker: either the bytes themselves or a
+    # shared memory block holding them
+    def __init__(self, body):
+        self.size = len(body)
+        self.shm = None
+        self.body = body
+        if self.size >= SHARED_MEMORY_MIN:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.size)
+            self.shm.buf[:self.size] = body
+            self.body = None
+
+    def args(self):
+        return self.body, self.shm.name if self.shm else None, self.size
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def _fetch(domain, item):
+    # Returns ((url, seconds left for the page's scripts), document)
+    url, document, script_time = fetch_site(domain, scan=False)
+    if FOLLOW_SCRIPTS and document.body:
+        document.script_srcs = script_sources(document.body)
+    return (url, script_time), document
+
+
+def staged_scan(domains, concurrency, scheduler, registry=None, previous=None,
+                analyze_workers=ANALYZE_WORKERS, analyze_queue=ANALYZE_QUEUE):
+    """Run (domain, item) pairs through resolve -> fetch -> analyze. Yields
+    (item, ScanResult, Document) as each site finishes (documents without their body).
+
+    previous(url), if given, returns the last stored result of a site,
+    which is reused when the page's tag fingerprint has not changed.
+    """
+    registry = registry or load_registry()
+    fetched = queue.Queue(maxsize=analyze_queue)
+    stop = threading.Event()
+
+    def fetch_stage():
+        try:
+            for item, (url, script_time), document in dispatch(prefetch_stream(domains, host_of),
+                                                               _fetch, concurrency, scheduler):
+                # Blocks while analysis is behind: that is the backpressure
+                while not stop.is_set():
+                    try:
+                        fetched.put((item, url, script_time, document), timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            fetched.put(e)
+        else:
+            fetched.put(_DONE)
+
+    def finish(url, document, mask, score, fingerprint):
+        error = str(document.error) if document.error else None
+        document.body = None
+        return ScanResult(url, score, mask, registry.version, error=error, fingerprint=fingerprint)
+
+    fetcher_thread = threading.Thread(target=fetch_stage, name="fetch-stage", daemon=True)
+    pool = ProcessPoolExecutor(max_workers=analyze_workers, mp_context=get_context("spawn"),
+                               initializer=_init_worker, initargs=(registry.path,))
+    # Script following is network work, so it gets threads of its own
+    scripts = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="scripts")
+    max_out = analyze_workers * 2
+    want_fingerprint = previous is not None
+    out = {}                     # future -> (item, url, script_time, document, handoff)
+    following = {}               # future -> (item, url, document, mask, score, fingerprint)
+    fetching = True
+    fetcher_thread.start()
+    try:
+        while fetching or out or following:
+            # 1. Take fetched pages while there is room in the pool; when
+            #    nothing is being analyzed, wait for the fetchers
+            while fetching and len(out) < max_out:
+                try:
+                    entry = fetched.get(timeout=None if not (out or following) else 0.01)
+                except queue.Empty:
+                    break
+                if entry is _DONE:
+                    fetching = False
+                    break
+                if isinstance(entry, BaseException):
+                    raise entry
+
+                item, url, script_time, document = entry
+                if not document.body:
+                    # Failed or empty: nothing to analyze
+                    yield item, finish(url, document, 0, 0, None), document
+                    continue
+                old = previous(url) if previous else None
+                fresh_old = old if old and old["signature_version"] == registry.version else None
+                handoff = _Handoff(document.body)
+                document.body = None
+                future = pool.submit(analyze_body, *handoff.args(),
+                                     fresh_old["fingerprint"] if fresh_old else None,
+                                     int.from_bytes(fresh_old["detections"] or b"", "little") if fresh_old else 0,
+                                     want_fingerprint)
+                out[future] = (item, url, script_time, document, handoff)
+
+            if not (out or following):
+                continue
+
+            # 2. Hand back whatever the workers (and script followers) have finished
+            done, _ = wait(list(out) + list(following),
+                           timeout=None if not fetching or len(out) >= max_out else 0.05,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in following:
+                    item, url, document, mask, score, fingerprint = following.pop(future)
+                    found = future.result()
+                    if registry.detection_mask(found) != mask:
+                        # Signatures only the page's scripts had add to the page's own
+                        mask, score = registry.detection_mask(found), registry.score(found)
+                    yield item, finish(url, document, mask, score, fingerprint), document
+                    continue
+
+                item, url, script_time, document, handoff = out.pop(future)
+                handoff.release()
+                mask, score, fingerprint, parse_seconds, match_seconds, reused = future.result()
+                if want_fingerprint:
+                    document.timings.add("parse", parse_seconds)
+                document.timings.add("match", match_seconds)
+                # A reused page's tags are unchanged since the last scan, so
+                # its scripts' detections came with the old result
+                if FOLLOW_SCRIPTS and document.script_srcs and not reused:
+                    follow = scripts.submit(follow_document_scripts, document, registry,
+                                            registry.signatures_in(mask), script_time)
+                    following[follow] = (item, url, document, mask, score, fingerprint)
+                    continue
+                yield item, finish(url, document, mask, score, fingerprint), document
+    finally:
+        stop.set()
+        for item, url, script_time, document, handoff in out.values():
+            handoff.release()
+        pool.shutdown(cancel_futures=True)
+        scripts.shutdown(wait=False, cancel_futures=True)
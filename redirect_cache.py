@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+# ============================================================
+# REDIRECT CACHE
+#
+# Most domains bounce through http -> https -> www -> /en-us/ before
+# the page arrives, and every scan used to walk the whole chain again:
+# three or four extra round trips per site. RedirectCache remembers,
+# per normalized input URL, where the chain ended and how it got there,
+# in SQLite so it survives between runs:
+#
+#   - younger than ttl: fetch_document asks the final URL directly; only
+#                       if that fails does it walk the chain from the
+#                       start again, and only a definite failure (HTTP
+#                       4xx/5xx, an error not worth retrying) drops the
+#                       entry; a timeout leaves it for the next try
+#   - older than ttl:   ignored, and replaced after the next full walk
+#
+# Set SIGNALIQ_REDIRECT_CACHE to a file path to move it, or to "" to
+# turn it off.
+# ============================================================
+
+REDIRECT_CACHE_PATH = os.environ.get(
+    "SIGNALIQ_REDIRECT_CACHE", os.path.join(tempfile.gettempdir(), "signaliq-redirects.sqlite")
+)
+REDIRECT_TTL = int(os.environ.get("SIGNALIQ_REDIRECT_TTL", 7 * 24 * 3600))
+
+
+class Redirect:
+    def __init__(self, key, final_url, chain, stored_at):
+        self.key = key
+        self.final_url = final_url
+        self.chain = chain             # every URL on the way, final one last
+        self.stored_at = stored_at
+
+
+class RedirectCache:
+    def __init__(self, path=REDIRECT_CACHE_PATH, ttl=REDIRECT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "fallbacks": 0}
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS redirects ("
+            " key TEXT PRIMARY KEY, final_url TEXT, chain TEXT, stored_at REAL)"
+        )
+        # Expired entries are of no use to anyone
+        self._db.execute("DELETE FROM redirects WHERE stored_at < ?", (time.time() - ttl,))
+
+    def lookup(self, key):
+        """The fresh Redirect stored for key, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT final_url, chain, stored_at FROM redirects WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[2] >= self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return Redirect(key, row[0], json.loads(row[1]), row[2])
+
+    def store(self, key, chain):
+        """Remember that key led through chain (final URL last). A chain that
+        went nowhere removes any old entry instead."""
+        with self._lock:
+            if len(chain) < 2:
+                self._db.execute("DELETE FROM redirects WHERE key = ?", (key,))
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO redirects (key, final_url, chain, stored_at) VALUES (?, ?, ?, ?)",
+                (key, chain[-1], json.dumps(chain), time.time()),
+            )
+            self.stats["stored"] += 1
+
+    def failed(self, key):
+        """The cached destination did not work: drop it (the chain is walked again)."""
+        with self._lock:
+            self.stats["fallbacks"] += 1
+            self._db.execute("DELETE FROM redirects WHERE key = ?", (key,))
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_redirect_cache():
+    """The process-wide redirect cache, or None when SIGNALIQ_REDIRECT_CACHE is set to ""."""
+    global _default_cache
+    if not REDIRECT_CACHE_PATH:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = RedirectCache()
+        return _default_cache
@@ -0,0 +1,74 @@
+import sys
+
+import numpy as np
+
+from signatures import REGISTRY_PATH, load_registry
+from store import STORE_PATH, ResultStore
+
+
+# ============================================================
+# RE-SCORING
+#
+# Changing a signature's "points" used to mean rescanning every site.
+# Stored results keep their detections as a bit set per row (bit n set
+# = signature id n found, see SignatureRegistry.detection_bits), so a
+# new score is just
+#
+#     min(base + detections @ points, max_score)
+#
+# over a (rows x signatures) boolean matrix: one NumPy pass per batch,
+# no network and no HTML.
+#
+# Usage: python rescore.py [results.sqlite] [signatures.json]
+# ============================================================
+
+# Rows loaded into one matrix at a time
+BATCH_ROWS = 500_000
+
+
+def unpack_detections(blobs, width):
+    """Turn packed detection blobs into a (len(blobs) x width) boolean matrix.
+    Blobs written before the registry grew are shorter; the missing ids count as not found."""
+    row_bytes = (width + 7) // 8
+    packed = np.frombuffer(
+        b"".join(blob[:row_bytes].ljust(row_bytes, b"\0") for blob in blobs), dtype=np.uint8
+    ).reshape(len(blobs), row_bytes)
+    return np.unpackbits(packed, axis=1, count=width, bitorder="little").astype(bool)
+
+
+def rescore(matrix, points, base=0, cap=100):
+    """Scores for every row of a detection matrix under a points vector (indexed by id)."""
+    points = np.asarray(points, dtype=np.int64)
+    return np.minimum(base + matrix @ points, cap)
+
+
+def rescore_store(store, registry=None, base=0, batch_rows=BATCH_ROWS):
+    """Recompute every stored score with the registry's current points.
+    Returns how many scores changed."""
+    registry = registry or load_registry()
+    points = registry.points_vector()
+    changed = 0
+
+    for rowids, old_scores, blobs in store.iter_detections(batch_rows):
+        scores = rescore(unpack_detections(blobs, registry.id_width), points, base, registry.max_score)
+        # Only rows whose score actually moved are written back
+        moved = np.flatnonzero(scores != np.asarray(old_scores))
+        store.update_scores((rowids[i], int(scores[i])) for i in moved)
+        changed += len(moved)
+
+    # signature_version stays what the detections were found with (the
+    # scanner's reuse check depends on it); points_version says whose
+    # points the score now comes from
+    store.set_points_version(registry.version)
+    store.sync_latest_scores()
+    return changed
+
+
+if __name__ == "__main__":
+    store_path = sys.argv[1] if len(sys.argv) > 1 else STORE_PATH
+    registry = load_registry(sys.argv[2] if len(sys.argv) > 2 else REGISTRY_PATH)
+
+    store = ResultStore(store_path, registry)
+    count = rescore_store(store, registry)
+    store.close()
+    print(f"Re-scored {store_path} with signatures {registry.version}: {count} scores changed")
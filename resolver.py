@@ -0,0 +1,192 @@
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import urllib3.util.connection as urllib3_connection
+
+from metrics import current as current_timings
+from singleflight import SingleFlight
+
+
+# ============================================================
+# DNS CACHE
+#
+# Every fetch used to pay for its own DNS lookup inside requests, and
+# a dead domain held a worker for the whole lookup timeout. Resolver
+# keeps answers for DNS_TTL seconds and failures for DNS_NEGATIVE_TTL,
+# and is hooked into urllib3's create_connection, so every connection
+# the shared session opens (scanner, handler, agent tools) uses it.
+#
+# prefetch() resolves upcoming hosts on a small thread pool while the
+# workers are still busy with earlier ones; the bulk scan feeds it the
+# domains as they are read off the input. A host that is being
+# prefetched is not looked up twice: resolve() waits for that answer.
+#
+# An unresolvable host fails straight out of the cache, before any
+# socket is opened.
+#
+# getaddrinfo does not tell us the record's real TTL, so DNS_TTL is a
+# fixed upper bound. Set SIGNALIQ_DNS_CACHE=0 to use plain DNS.
+#
+# The hook also times the lookup and the TCP handshake for the fetch's
+# Timings (metrics.py); with the cache off both count as "connect".
+# ============================================================
+
+DNS_CACHE = os.environ.get("SIGNALIQ_DNS_CACHE", "1") != "0"
+DNS_TTL = int(os.environ.get("SIGNALIQ_DNS_TTL", 300))
+DNS_NEGATIVE_TTL = int(os.environ.get("SIGNALIQ_DNS_NEGATIVE_TTL", 60))
+DNS_WORKERS = int(os.environ.get("SIGNALIQ_DNS_WORKERS", 32))
+DNS_MAX_ENTRIES = 100_000
+
+
+class Resolver:
+    def __init__(self, ttl=DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL, workers=DNS_WORKERS,
+                 max_entries=DNS_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "failures": 0, "prefetched": 0}
+        self._cache = OrderedDict()    # host -> (expires, [ips] or socket.gaierror)
+        self._lookups = SingleFlight()  # hosts being looked up
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dns")
+
+    def _lookup(self, host):
+        try:
+            infos = socket.getaddrinfo(host, None, urllib3_connection.allowed_gai_family(), socket.SOCK_STREAM)
+            # Keep getaddrinfo's order (it is the order to try them in), once each
+            answer = list(dict.fromkeys(info[4][0] for info in infos))
+            ttl = self.ttl
+        except socket.gaierror as e:
+            answer = e
+            ttl = self.negative_ttl
+        except UnicodeError as e:
+            answer = socket.gaierror(socket.EAI_NONAME, f"Invalid host name {host!r}: {e}")
+            ttl = self.negative_ttl
+
+        with self._lock:
+            self._cache[host] = (time.monotonic() + ttl, answer)
+            self._cache.move_to_end(host)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return answer
+
+    def _cached(self, host):
+        # Call with the lock held
+        entry = self._cache.get(host)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[host]
+            return None
+        return entry[1]
+
+    def resolve(self, host):
+        """The IP addresses for host, from the cache if possible. Raises socket.gaierror."""
+        with self._lock:
+            answer = self._cached(host)
+        if answer is None:
+            answer, _ = self._lookups.do(host, partial(self._lookup, host))
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+
+        if isinstance(answer, socket.gaierror):
+            self.stats["failures"] += 1
+            # A fresh exception each time, so tracebacks do not pile up on one object
+            raise socket.gaierror(answer.errno, answer.strerror)
+        return answer
+
+    def prefetch(self, hosts):
+        """Start resolving hosts in the background (hosts already cached or on their way are skipped)."""
+        with self._lock:
+            for host in hosts:
+                if self._cached(host) is not None:
+                    continue
+                if self._lookups.start(host, partial(self._lookup, host), self._pool):
+                    self.stats["prefetched"] += 1
+
+    def cached_ip(self, host):
+        """The first cached address of host, or None (never does a lookup)."""
+        with self._lock:
+            answer = self._cached(host)
+        return answer[0] if isinstance(answer, list) and answer else None
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+_original_create_connection = urllib3_connection.create_connection
+
+
+def get_resolver():
+    """The process-wide Resolver, or None when SIGNALIQ_DNS_CACHE=0."""
+    global _resolver
+    if not DNS_CACHE:
+        return None
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = Resolver()
+        return _resolver
+
+
+def _create_connection(address, *args, **kwargs):
+    # urllib3's create_connection, but with the host looked up through the
+    # cache. Each cached address is handed to the original as an IP literal
+    # (which getaddrinfo answers without DNS); TLS still sees the real host
+    # name, because urllib3 takes SNI and certificate checks from the
+    # connection, not from the socket.
+    host, port = address
+    resolver = get_resolver()
+    timings = current_timings()
+    start = time.perf_counter()
+    if resolver is None:
+        try:
+            return _original_create_connection(address, *args, **kwargs)
+        finally:
+            if timings is not None:
+                timings.add("connect", time.perf_counter() - start)
+
+    try:
+        ips = resolver.resolve(host.strip("[]"))
+    finally:
+        if timings is not None:
+            timings.add("dns", time.perf_counter() - start)
+
+    err = None
+    for ip in ips:
+        start = time.perf_counter()
+        try:
+            return _original_create_connection((ip, port), *args, **kwargs)
+        except OSError as e:
+            err = e
+        finally:
+            if timings is not None:
+                timings.add("connect", time.perf_counter() - start)
+    raise err or OSError(f"No addresses for {host}")
+
+
+def install():
+    """Route urllib3's connections through the shared Resolver (or, with the
+    cache off, just time them). Safe to call more than once."""
+    urllib3_connection.create_connection = _create_connection
+
+
+def prefetch_stream(pairs, host_of, batch_size=100):
+    """Pass (url, item) pairs through unchanged, prefetching the hosts of
+    each batch_size of them as they are read."""
+    resolver = get_resolver()
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) >= batch_size:
+            if resolver:
+                resolver.prefetch(host_of(url) for url, _ in batch)
+            yield from batch
+            batch = []
+    if resolver and batch:
+        resolver.prefetch(host_of(url) for url, _ in batch)
+    yield from batch
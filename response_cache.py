@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+# ============================================================
+# RESPONSE CACHE
+#
+# An on-disk (SQLite) cache of page bodies, keyed by normalized URL.
+# Each entry keeps the body plus the ETag / Last-Modified validators
+# the server sent.
+#
+#   - younger than ttl: served straight from disk, no network at all
+#   - older than ttl:   revalidated with If-None-Match / If-Modified-Since;
+#                       a 304 refreshes the entry and the stored body is used
+#   - over max_bytes:   least recently used entries are dropped
+#
+# Set SIGNALIQ_CACHE to a file path to move it, or to "" to turn it off.
+# ============================================================
+
+CACHE_PATH = os.environ.get("SIGNALIQ_CACHE", os.path.join(tempfile.gettempdir(), "signaliq-cache.sqlite"))
+CACHE_TTL = int(os.environ.get("SIGNALIQ_CACHE_TTL", 3600))
+CACHE_MAX_BYTES = int(os.environ.get("SIGNALIQ_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Only these response headers are kept with a cached body
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class CacheEntry:
+    def __init__(self, key, url, headers, body, stored_at, ttl):
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.fresh = time.time() - stored_at < ttl
+
+    def conditional_headers(self):
+        # What we send to ask "has this changed since we stored it?"
+        headers = {}
+        if self.headers.get("ETag"):
+            headers["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, url TEXT, headers TEXT, body BLOB,"
+            " size INTEGER, stored_at REAL, used_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        with self._lock:
+            self._evict()
+
+    def lookup(self, key):
+        """Return the CacheEntry for key (fresh or stale), or None. Counts a hit if fresh."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, headers, body, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+            entry = CacheEntry(key, row[0], json.loads(row[1]), row[2], row[3], self.ttl)
+            # A stale entry only counts once we know whether the server kept it
+            if entry.fresh:
+                self.stats["hits"] += 1
+            return entry
+
+    def revalidated(self, entry, headers):
+        """The server answered 304: the stored body is good for another ttl."""
+        kept = dict(entry.headers)
+        kept.update({name: headers[name] for name in KEPT_HEADERS if name in headers and name != "Content-Type"})
+        with self._lock:
+            self.stats["revalidated"] += 1
+            self._db.execute(
+                "UPDATE responses SET headers = ?, stored_at = ? WHERE key = ?",
+                (json.dumps(kept), time.time(), entry.key),
+            )
+        entry.headers = kept
+
+    def changed(self, entry):
+        """The server sent a new body for a stale entry."""
+        with self._lock:
+            self.stats["misses"] += 1
+
+    def store(self, key, url, headers, body):
+        kept = {name: headers[name] for name in KEPT_HEADERS if name in headers}
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, url, headers, body, size, stored_at, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, json.dumps(kept), body, len(body), now, now),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            self.stats["stored"] += 1
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until we are back under max_bytes
+        while self._size > self.max_bytes:
+            row = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY used_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._size -= row[1]
+            self.stats["evicted"] += 1
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide cache, or None when SIGNALIQ_CACHE is set to ""."""
+    global _default_cache
+    if not CACHE_PATH:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
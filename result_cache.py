@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from singleflight import SingleFlight
+
+
+# ============================================================
+# RESULT CACHE
+#
+# The CRM integrations ask the handler about the same domains over and
+# over. ResultCache keeps finished analyze_target results in memory,
+# keyed by (normalized URL, signature version), for as long as the
+# function's container stays warm:
+#
+#   - younger than ttl:         returned as is
+#   - up to ttl + stale older:  returned as is, and refreshed in the
+#                               background for the next caller
+#   - older than that:          scanned again, the caller waits
+#
+# Callers asking for the same key while it is being scanned wait for
+# that one scan instead of starting their own, and a key is never
+# refreshed twice at once. Failed scans are not kept.
+#
+#   SIGNALIQ_RESULT_CACHE=0      turn it off
+#   SIGNALIQ_RESULT_TTL          seconds a result stays fresh (600)
+#   SIGNALIQ_RESULT_STALE        seconds after that it may still be served (3600)
+# ============================================================
+
+RESULT_CACHE = os.environ.get("SIGNALIQ_RESULT_CACHE", "1") != "0"
+RESULT_TTL = int(os.environ.get("SIGNALIQ_RESULT_TTL", 600))
+RESULT_STALE = int(os.environ.get("SIGNALIQ_RESULT_STALE", 3600))
+RESULT_MAX_ENTRIES = 10_000
+REFRESH_WORKERS = 4
+
+
+class ResultCache:
+    def __init__(self, ttl=RESULT_TTL, stale=RESULT_STALE, max_entries=RESULT_MAX_ENTRIES,
+                 refresh_workers=REFRESH_WORKERS, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self.clock = clock
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "joined": 0, "refreshed": 0}
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._scans = SingleFlight()   # keys being scanned
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="refresh")
+
+    def get(self, key, compute, refresh=None, keep=None):
+        """The value for key, calling compute() when there is none to give.
+
+        refresh() (compute by default) is what runs in the background for a
+        stale entry; keep(value) says whether a new value may be cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            age = self.clock() - entry[0] if entry else None
+            if entry and age < self.ttl:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            if entry and age < self.ttl + self.stale:
+                self._entries.move_to_end(key)
+                self.stats["stale"] += 1
+                if self._scans.start(key, partial(self._compute, key, refresh or compute, keep), self._pool):
+                    self.stats["refreshed"] += 1
+                return entry[1]
+
+        value, joined = self._scans.do(key, partial(self._compute, key, compute, keep))
+        with self._lock:
+            self.stats["joined" if joined else "misses"] += 1
+        return value
+
+    def _compute(self, key, compute, keep):
+        value = compute()
+        if keep is None or keep(value):
+            with self._lock:
+                self._entries[key] = (self.clock(), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """The process-wide ResultCache, or None when SIGNALIQ_RESULT_CACHE=0."""
+    global _result_cache
+    if not RESULT_CACHE:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
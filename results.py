@@ -0,0 +1,194 @@
+import csv
+from array import array
+
+from signatures import load_registry
+
+
+# ============================================================
+# SCAN RESULTS
+#
+# Results used to travel as dicts with the tech stack as a list or a
+# comma-joined string of names. ScanResult holds the same thing in a
+# few slots, with the tech stack as an int bitmask by signature id
+# (SignatureRegistry.detection_mask), and converts to and from both old
+# shapes:
+#
+#   to_row() / from_row()        {"URL", "Score", "Tech Stack", "Signature Version"}
+#                                (plus "Error" for a failed scan)
+#   to_target() / from_target()  analyze_target's {"status", "url", "wealth_score", ...}
+#
+# Either shape gets the fetch's stage timings (metrics.py) as well when
+# a Timings is attached to the result.
+#
+# ScanResults keeps a whole scan in arrays instead of one object per
+# row: scores in an array, tech stacks as fixed-width packed bits (the
+# same layout the store and rescore.py use), and the signature version
+# and errors only where they differ.
+# ============================================================
+
+
+class ScanResult:
+    __slots__ = ("url", "score", "tech", "signature_version", "error", "fingerprint", "timings")
+
+    def __init__(self, url, score=0, tech=0, signature_version=None, error=None, fingerprint=None,
+                 timings=None):
+        self.url = url
+        self.score = score
+        self.tech = tech                          # bitmask, bit n = signature id n
+        self.signature_version = signature_version
+        self.error = error                        # message if the scan failed
+        self.fingerprint = fingerprint            # tag_fingerprint, if one was taken
+        self.timings = timings                    # metrics.Timings, when attached to the row
+
+    def __repr__(self):
+        return f"ScanResult({self.url!r}, score={self.score}, tech={self.tech:#x})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ScanResult):
+            return NotImplemented
+        # How long it took is not part of the result
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__ if name != "timings")
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @classmethod
+    def from_signatures(cls, url, found, score, registry=None, **kwargs):
+        registry = registry or load_registry()
+        kwargs.setdefault("signature_version", registry.version)
+        return cls(url, score, registry.detection_mask(found), **kwargs)
+
+    def technologies(self, registry=None):
+        """Names of the detected technologies, in registry order."""
+        return [sig["name"] for sig in (registry or load_registry()).signatures_in(self.tech)]
+
+    # --- the bulk scan / CSV row ---
+
+    @classmethod
+    def from_row(cls, row, registry=None):
+        registry = registry or load_registry()
+        names = [name.strip() for name in (row.get("Tech Stack") or "").split(",") if name.strip()]
+        found = [registry.by_name[name] for name in names if name in registry.by_name]
+        return cls(row["URL"], int(row.get("Score") or 0), registry.detection_mask(found),
+                   row.get("Signature Version"), error=row.get("Error") or None,
+                   fingerprint=row.get("Fingerprint"))
+
+    def to_row(self, registry=None):
+        row = {
+            "URL": self.url,
+            "Score": self.score,
+            "Tech Stack": ", ".join(self.technologies(registry)),
+            "Signature Version": self.signature_version
+        }
+        if self.fingerprint:
+            row["Fingerprint"] = self.fingerprint
+        if self.error is not None:
+            row["Error"] = self.error
+        if self.timings is not None:
+            row.update(self.timings.as_row())
+        return row
+
+    # --- analyze_target / the handler ---
+
+    @classmethod
+    def from_target(cls, result, registry=None):
+        if result.get("status") == "error":
+            return cls(result.get("url"), error=result.get("message", ""))
+        registry = registry or load_registry()
+        found = [registry.by_name[name] for name in result["tech_stack"] if name in registry.by_name]
+        return cls(result["url"], result["wealth_score"], registry.detection_mask(found),
+                   result.get("signature_version"))
+
+    def to_target(self, registry=None):
+        if self.error is not None:
+            target = {
+                "status": "error",
+                "message": self.error
+            }
+        else:
+            target = {
+                "status": "success",
+                "url": self.url,
+                "wealth_score": self.score,
+                "tech_stack": self.technologies(registry),
+                "signature_version": self.signature_version
+            }
+        if self.timings is not None:
+            target["timings"] = self.timings.as_dict()
+        return target
+
+
+class ScanResults:
+    """A batch of ScanResults stored column-wise. Indexing builds a ScanResult on the fly."""
+
+    def __init__(self, results=(), registry=None):
+        self.registry = registry or load_registry()
+        self.row_bytes = max(1, (self.registry.id_width + 7) // 8)
+        self.urls = []
+        self.scores = array("h")
+        self.tech = bytearray()        # row_bytes per result, little-endian bitmask
+        self._versions = []            # each distinct signature version once
+        self._version_of = array("B")  # index into _versions, per result
+        self._errors = {}              # result index -> message, failed scans only
+        self._fingerprints = {}        # result index -> fingerprint, when taken
+        self.extend(results)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        start = n * self.row_bytes
+        return ScanResult(
+            self.urls[n],
+            self.scores[n],
+            int.from_bytes(self.tech[start:start + self.row_bytes], "little"),
+            self._versions[self._version_of[n]],
+            self._errors.get(n),
+            self._fingerprints.get(n),
+        )
+
+    def append(self, result):
+        if result.signature_version not in self._versions:
+            self._versions.append(result.signature_version)
+        n = len(self.urls)
+        self.urls.append(result.url)
+        self.scores.append(result.score)
+        self.tech += result.tech.to_bytes(self.row_bytes, "little")
+        self._version_of.append(self._versions.index(result.signature_version))
+        if result.error is not None:
+            self._errors[n] = result.error
+        if result.fingerprint:
+            self._fingerprints[n] = result.fingerprint
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def packed(self):
+        """Every tech stack as one bytes object, row_bytes per result (see rescore.unpack_detections)."""
+        return bytes(self.tech)
+
+    def to_rows(self):
+        for result in self:
+            yield result.to_row(self.registry)
+
+    def to_csv(self, path, fieldnames=("URL", "Score", "Tech Stack", "Signature Version")):
+        with open(path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.to_rows())
+
+    @classmethod
+    def from_csv(cls, path, registry=None):
+        registry = registry or load_registry()
+        with open(path, newline='', encoding='utf-8') as file:
+            return cls((ScanResult.from_row(row, registry) for row in csv.DictReader(file)), registry)
@@ -0,0 +1,382 @@
+import csv
+import os
+import sqlite3
+import threading
+from collections import deque
+from itertools import chain
+
+from bundles import FOLLOW_SCRIPTS, follow_document_scripts, script_sources
+from fetcher import fetch_site, normalize_url
+from metrics import METRICS_IN_ROWS, TIMING_COLUMNS, get_metrics
+from pipeline import ANALYZE_WORKERS, staged_scan
+from results import ScanResult, ScanResults
+from resolver import get_resolver, prefetch_stream
+from scheduler import THROTTLE_STATUSES, PolitenessScheduler, dispatch, host_of
+from signatures import load_registry, tag_fingerprint
+from store import ResultStore
+
+
+# ============================================================
+# BULK SCAN
+#
+# The bulk scan used to hold the whole domain list in memory and write
+# scan_results.csv once at the very end, so a crash lost everything.
+# run_scan() is a pipeline of generators instead:
+#
+#   iter_domains   streams domains out of a .txt or .csv file
+#   SeenSet        drops duplicates (after normalize_url) using a SQLite
+#                  file next to the output, so memory stays flat
+#   ResultSink     appends each row to the CSV as soon as it is scanned,
+#                  flushing to disk every FLUSH_EVERY rows
+#   StoreSink      the same, into a ResultStore (store.py) instead
+#
+# The seen-set doubles as the checkpoint: a domain is marked done only
+# once its row has been flushed. Run the same command again after an
+# interruption and the finished domains are skipped; anything that was
+# in flight is scanned again.
+#
+# With SIGNALIQ_FOLLOW_SCRIPTS=1 the scripts each page loads are scanned
+# too (bundles.py); a page reused by fingerprint keeps its old result.
+#
+# Each site's stage timings go to metrics.py under source "bulk", and
+# with SIGNALIQ_METRICS_IN_ROWS=1 onto its row as well (extra CSV
+# columns; the store does not keep them).
+# ============================================================
+
+# How many sites we fetch at the same time overall, and how many of
+# those are allowed to hit the same host at once (request rates per
+# host and per IP are in scheduler.py)
+SCAN_CONCURRENCY = 20
+PER_HOST_LIMIT = 2
+
+# Rows are flushed (and checkpointed) in batches of this size
+FLUSH_EVERY = int(os.environ.get("SIGNALIQ_FLUSH_EVERY", 100))
+
+FIELDNAMES = ["URL", "Score", "Tech Stack", "Signature Version"]
+
+# Header cells that name the domain column of an input CSV
+DOMAIN_COLUMNS = ("url", "domain", "website", "site")
+
+
+def scan_result(url, registry=None, previous=None):
+    """Scan one site into a ScanResult. previous(url), if given, returns the
+    stored result of the last scan (ResultStore.previous); when the page's
+    tag_fingerprint and the signature version both still match, that
+    result is reused instead of running the signature pass again."""
+    return fetch_and_scan(url, registry, previous)[0]
+
+
+def fetch_and_scan(url, registry=None, previous=None):
+    # scan_result, plus the Document it came from (the scheduler wants
+    # its status, Retry-After and peer IP)
+    registry = registry or load_registry()
+
+    # 1. Fetch ONCE & Analyze: the page is scanned while it downloads
+    if previous is None:
+        clean_url, document, script_time = fetch_site(url, registry=registry, keep_body=False)
+        found = document.signatures
+        fingerprint = None
+    else:
+        # Download first, then only scan if the markup changed since last time
+        clean_url, document, script_time = fetch_site(url, registry=registry, scan=False)
+        with document.timings.stage("parse"):
+            fingerprint = tag_fingerprint(document.body or b"") if document.ok else None
+        old = previous(clean_url)
+        if (old and fingerprint and old["fingerprint"] == fingerprint
+                and old["signature_version"] == registry.version):
+            # The script/link tags are the same, so their detections (and
+            # those of the scripts they load) still hold; body-scope ones
+            # can change with any text, so those are matched again
+            with document.timings.stage("match"):
+                found = registry.detect_with_tags(document.body, int.from_bytes(old["detections"] or b"", "little"))
+            result = ScanResult.from_signatures(clean_url, found, registry.score(found), registry,
+                                                fingerprint=fingerprint)
+            return result, document
+        with document.timings.stage("match"):
+            found = registry.detect(document.body) if document.body else []
+        document.script_srcs = script_sources(document.body) if FOLLOW_SCRIPTS else []
+
+    # 1b. Optionally the scripts the page loads, too (bundles.py)
+    if FOLLOW_SCRIPTS and document.ok:
+        found = follow_document_scripts(document, registry, found, script_time)
+
+    # 2. Build the result (the tech stack is kept as a bitmask)
+    error = str(document.error) if document.error else None
+    result = ScanResult.from_signatures(clean_url, found, registry.score(found), registry,
+                                        error=error, fingerprint=fingerprint)
+    return result, document
+
+
+def scan_website(url, registry=None, previous=None):
+    """Scan one site into a row for our database list (scan_result, as a dict)."""
+    return scan_result(url, registry, previous).to_row(registry)
+
+
+def polite_scan(domains, concurrency=SCAN_CONCURRENCY, per_host_limit=PER_HOST_LIMIT, registry=None,
+                previous=None, analyze_workers=ANALYZE_WORKERS):
+    """Scan (domain, item) pairs through the politeness scheduler (scheduler.py).
+    Yields (item, ScanResult) as each site finishes, in no particular order.
+
+    With analyze_workers > 0 pages are analyzed in a process pool
+    (pipeline.py); with 0 each fetch thread scans its own page.
+    """
+    registry = registry or load_registry()
+    rejected = deque()
+
+    def valid(pairs):
+        # A malformed entry (bad port, unclosed [) would take the scheduler
+        # down with it; it gets an error result of its own instead
+        for domain, item in pairs:
+            try:
+                normalize_url(domain)
+            except ValueError as e:
+                rejected.append((item, ScanResult(domain, signature_version=registry.version, error=str(e))))
+                continue
+            yield domain, item
+
+    domains = valid(domains)
+    resolver = get_resolver()
+    pacing = PolitenessScheduler(per_host_limit, ip_of=resolver.cached_ip if resolver else None)
+
+    if analyze_workers:
+        finished = staged_scan(domains, concurrency, pacing, registry, previous, analyze_workers)
+    else:
+        def work(domain, item):
+            return fetch_and_scan(domain, registry, previous)
+
+        # Hosts are looked up in the background as the domains are read ahead,
+        # so by the time a worker gets one its address is usually cached
+        finished = dispatch(prefetch_stream(domains, host_of), work, concurrency, pacing)
+
+    metrics = get_metrics()
+    for item, result, document in finished:
+        while rejected:
+            yield rejected.popleft()
+        if document.status_code in THROTTLE_STATUSES and result.error is None:
+            # Still throttled after every retry: whatever the 429 page
+            # matched says nothing about the site
+            result = ScanResult(result.url, signature_version=result.signature_version,
+                                error=f"HTTP {document.status_code} (rate limited)")
+        metrics.record(document.timings, "bulk")
+        if METRICS_IN_ROWS:
+            result.timings = document.timings
+        yield item, result
+    while rejected:
+        yield rejected.popleft()
+
+
+def scan_websites(target_websites, concurrency=SCAN_CONCURRENCY, per_host_limit=PER_HOST_LIMIT, compact=False):
+    """Scan many sites at once. Rows come back in the same order as target_websites,
+    as dicts, or with compact=True as one ScanResults batch."""
+    registry = load_registry()
+    results = [None] * len(target_websites)
+    for n, result in polite_scan(((url, n) for n, url in enumerate(target_websites)),
+                                 concurrency, per_host_limit, registry):
+        results[n] = result
+    return ScanResults(results, registry) if compact else [result.to_row(registry) for result in results]
+
+
+def iter_domains(path):
+    """Yield the domains in a text file (one per line) or a CSV file (the url/domain
+    column if the header names one, otherwise the first column)."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if not path.lower().endswith('.csv'):
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+            return
+
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [cell.strip().lower() for cell in first]
+        column = next((header.index(name) for name in DOMAIN_COLUMNS if name in header), None)
+        if column is None:
+            # No header row: the first row is data too
+            column = 0
+            reader = chain([first], reader)
+        for row in reader:
+            if len(row) > column and row[column].strip():
+                yield row[column].strip()
+
+
+class SeenSet:
+    """Disk-backed set of normalized URLs, with a done flag per URL.
+
+    The fetch stage adds URLs while the writer marks them done, so one
+    lock guards the connection. Additions are committed together with
+    the next batch of done marks, so one transaction per flush instead
+    of one per domain.
+    """
+
+    def __init__(self, path, fresh=False):
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY, done INTEGER NOT NULL DEFAULT 0)")
+        # Anything not marked done never made it to the output: scan it again
+        self._db.execute("DELETE FROM seen WHERE done = 0")
+        self._db.commit()
+
+    def add(self, key):
+        """Remember key. False if it was already seen (this run or a finished earlier one)."""
+        with self._lock:
+            return self._db.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (key,)).rowcount == 1
+
+    def mark_done(self, keys):
+        with self._lock:
+            self._db.executemany("UPDATE seen SET done = 1 WHERE url = ?", ((key,) for key in keys))
+            self._db.commit()
+
+    def done_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM seen WHERE done = 1").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def unique_domains(domains, seen):
+    """Yield (key, domain) for every domain not seen before, key being its normalized URL."""
+    for domain in domains:
+        try:
+            key = normalize_url(domain)
+        except ValueError:
+            print(f"Skipping {domain!r}: not a valid URL")
+            continue
+        if seen.add(key):
+            yield key, domain
+
+
+class ResultSink:
+    """Appends rows to a CSV file, flushing every flush_every rows.
+
+    on_flush(keys) is called once a batch is safely on disk, which is when
+    run_scan checkpoints those domains as done.
+    """
+
+    def __init__(self, path, fieldnames=FIELDNAMES, flush_every=FLUSH_EVERY, on_flush=None):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, mode='a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore')
+        if new_file:
+            self._writer.writeheader()
+        self.flush_every = flush_every
+        self.on_flush = on_flush
+        self.written = 0
+        self._pending = []
+
+    def write(self, row, key=None):
+        self._write(row)
+        self.written += 1
+        self._pending.append(key)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._sync()
+        if self.on_flush and self._pending:
+            self.on_flush([key for key in self._pending if key is not None])
+        self._pending = []
+
+    def finish(self):
+        """Every domain has been written (the run was not interrupted)."""
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def _write(self, row):
+        self._writer.writerow(row)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+class StoreSink(ResultSink):
+    """Same batching as ResultSink, but rows go into a ResultStore (store.py)
+    under one scan id, committed once per batch."""
+
+    def __init__(self, store, flush_every=FLUSH_EVERY, on_flush=None, resume=True):
+        self.store = store
+        self.scan_id = store.begin_scan(load_registry().version, resume=resume)
+        self.flush_every = flush_every
+        self.on_flush = on_flush
+        self.written = 0
+        self._pending = []
+
+    def finish(self):
+        self.flush()
+        self.store.finish_scan(self.scan_id)
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+    def _write(self, row):
+        self.store.upsert(self.scan_id, row)
+
+    def _sync(self):
+        self.store.commit()
+
+
+def run_scan(source, output_path, concurrency=SCAN_CONCURRENCY, per_host_limit=PER_HOST_LIMIT,
+             flush_every=FLUSH_EVERY, fresh=False):
+    """Scan every domain in source (a .txt/.csv path or any iterable of domains),
+    writing rows to output_path as they finish. Returns how many rows were written.
+
+    A .csv output_path gets rows appended to it; anything else is a
+    ResultStore (store.py) and the rows are stored under one scan id.
+    Re-running with the same output_path resumes an interrupted run;
+    fresh=True starts over (a new CSV file, or a new scan in the store).
+    """
+    checkpoint_path = output_path + ".seen"
+    to_csv = output_path.lower().endswith(".csv")
+    if fresh and to_csv and os.path.exists(output_path):
+        os.remove(output_path)
+
+    domains = iter_domains(source) if isinstance(source, (str, os.PathLike)) else source
+    seen = SeenSet(checkpoint_path, fresh=fresh)
+    skipped = seen.done_count()
+    if skipped:
+        print(f"Resuming: {skipped} sites already in {output_path}")
+
+    if to_csv:
+        fieldnames = FIELDNAMES + TIMING_COLUMNS if METRICS_IN_ROWS else FIELDNAMES
+        sink = ResultSink(output_path, fieldnames, flush_every, on_flush=seen.mark_done)
+    else:
+        sink = StoreSink(ResultStore(output_path), flush_every, on_flush=seen.mark_done, resume=not fresh)
+    registry = load_registry()
+
+    # With a store, unchanged pages reuse their last result (see scan_result)
+    previous = None if to_csv else sink.store.previous
+
+    completed = False
+    try:
+        # The scheduler only reads READ_AHEAD domains ahead of the workers,
+        # so the input file is never loaded whole
+        pending = ((domain, key) for key, domain in unique_domains(domains, seen))
+        for key, result in polite_scan(pending, concurrency, per_host_limit, registry, previous):
+            sink.write(result.to_row(registry), key)
+        sink.finish()
+        completed = True
+    finally:
+        sink.close()
+        seen.close()
+
+    # A store keeps every scan, so once this one is complete the next run
+    # is a new scan rather than a resume. (An appended CSV keeps its
+    # checkpoint, or a re-run would add every row a second time.)
+    if completed and not to_csv:
+        os.remove(checkpoint_path)
+
+    return sink.written
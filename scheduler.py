@@ -0,0 +1,315 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+# ============================================================
+# POLITENESS SCHEDULER
+#
+# With 20 fetches in flight, a list full of storefronts on the same
+# host (or on one CDN edge IP) gets hammered, and the answer is 429s
+# and tarpits. The scheduler sits between the domain stream and the
+# worker pool and only hands out a fetch when:
+#
+#   - the host has fewer than per_host_limit fetches open
+#   - the host's token bucket has a token (HOST_RATE per second)
+#   - the bucket of the IP the host was last served from has one too
+#     (IP_RATE per second); IPs are learned from the connection, or
+#     from the DNS cache before a host's first fetch
+#
+# A 429/503 pauses the host (and its IP) for Retry-After seconds, halves
+# its rate (which creeps back up with every success) and puts the domain
+# back in the queue. Throttled hosts just
+# sit in the queue while every other host keeps going, so the workers
+# never block waiting on one slow host. After MAX_RETRIES the domain is
+# given up on.
+#
+# A host is forgotten once it has nothing queued or in flight (unless
+# it is still recovering from a throttle we did not give up on), and an
+# IP once no remaining host is served from it and it is not paused.
+#
+# Only the thread driving dispatch() touches a scheduler, so there is
+# no locking.
+# ============================================================
+
+HOST_RATE = float(os.environ.get("SIGNALIQ_HOST_RATE", 2))
+HOST_BURST = int(os.environ.get("SIGNALIQ_HOST_BURST", 2))
+IP_RATE = float(os.environ.get("SIGNALIQ_IP_RATE", 10))
+IP_BURST = int(os.environ.get("SIGNALIQ_IP_BURST", 10))
+
+# A throttled host never drops below this many requests per second
+MIN_RATE = 0.1
+
+THROTTLE_STATUSES = (429, 503)
+MAX_RETRIES = 3
+# Without a Retry-After header we back off this long (doubling per retry);
+# a Retry-After longer than MAX_RETRY_AFTER is not worth waiting for
+DEFAULT_BACKOFF = 5
+MAX_RETRY_AFTER = 300
+
+# How many domains are read off the input ahead of the workers, so that
+# a throttled host does not leave the pool with nothing to do
+READ_AHEAD = int(os.environ.get("SIGNALIQ_READ_AHEAD", 1000))
+
+
+def host_of(url):
+    return urlparse(url if url.startswith('http') else 'https://' + url).hostname or url
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - (now or time.time()))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now=None):
+        """Seconds until a token can be taken (0 = now)."""
+        now = self.clock() if now is None else now
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hold off for seconds and halve the rate. Several 429s from the
+        same burst only halve it once."""
+        now = self.clock()
+        if now >= self.paused_until:
+            self.rate = max(MIN_RATE, self.rate / 2)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def recover(self, limit):
+        # After a success, creep back up towards the configured rate
+        self.rate = min(limit, self.rate + limit / 10)
+
+
+class Job:
+    __slots__ = ("url", "host", "item", "attempts")
+
+    def __init__(self, url, item):
+        self.url = url
+        self.host = host_of(url)
+        self.item = item
+        self.attempts = 0
+
+
+class _Host:
+    __slots__ = ("jobs", "bucket", "in_flight", "ip")
+
+    def __init__(self, bucket):
+        self.jobs = deque()
+        self.bucket = bucket
+        self.in_flight = 0
+        self.ip = None
+
+
+class PolitenessScheduler:
+    def __init__(self, per_host_limit=2, host_rate=HOST_RATE, host_burst=HOST_BURST,
+                 ip_rate=IP_RATE, ip_burst=IP_BURST, clock=time.monotonic, ip_of=None):
+        self.per_host_limit = per_host_limit
+        self.ip_of = ip_of             # host -> IP before its first fetch (e.g. Resolver.cached_ip)
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.clock = clock
+        self.pending = 0               # queued jobs, not counting those in flight
+        self.stats = {"dispatched": 0, "throttled": 0, "gave_up": 0}
+        self._hosts = {}
+        self._ips = {}
+        self._ip_hosts = {}            # IP -> how many hosts in _hosts were last served from it
+        self._queued_hosts = deque()   # hosts with queued jobs, round-robin
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _Host(TokenBucket(self.host_rate, self.host_burst, self.clock))
+        return self._hosts[host]
+
+    def _set_ip(self, state, ip):
+        if ip == state.ip:
+            return
+        self._release_ip(state.ip)
+        state.ip = ip
+        if ip not in self._ips:
+            self._ips[ip] = TokenBucket(self.ip_rate, self.ip_burst, self.clock)
+        self._ip_hosts[ip] = self._ip_hosts.get(ip, 0) + 1
+
+    def _release_ip(self, ip):
+        # An IP no host is served from any more is dropped, unless it is
+        # still paused: a new host on it has to wait that out too
+        if ip is None:
+            return
+        self._ip_hosts[ip] -= 1
+        if not self._ip_hosts[ip]:
+            del self._ip_hosts[ip]
+            if self.clock() >= self._ips[ip].paused_until:
+                del self._ips[ip]
+
+    def _queue(self, job, front=False):
+        state = self._host(job.host)
+        if not state.jobs:
+            self._queued_hosts.append(job.host)
+        if front:
+            state.jobs.appendleft(job)
+        else:
+            state.jobs.append(job)
+        self.pending += 1
+
+    def add(self, url, item=None):
+        self._queue(Job(url, item))
+
+    def next_job(self):
+        """The next job that may go out now, or None. Hosts are tried round-robin,
+        so a throttled host is skipped rather than waited on."""
+        now = self.clock()
+        for _ in range(len(self._queued_hosts)):
+            host = self._queued_hosts[0]
+            self._queued_hosts.rotate(-1)
+            state = self._hosts[host]
+            if state.in_flight >= self.per_host_limit or state.bucket.wait_time(now) > 0:
+                continue
+            if state.ip is None and self.ip_of is not None:
+                ip = self.ip_of(host)
+                if ip:
+                    self._set_ip(state, ip)
+            ip_bucket = self._ips.get(state.ip)
+            if ip_bucket is not None and ip_bucket.wait_time(now) > 0:
+                continue
+
+            state.bucket.take()
+            if ip_bucket is not None:
+                ip_bucket.take()
+            state.in_flight += 1
+            job = state.jobs.popleft()
+            if not state.jobs:
+                self._queued_hosts.remove(host)
+            self.pending -= 1
+            job.attempts += 1
+            self.stats["dispatched"] += 1
+            return job
+        return None
+
+    def wait_time(self):
+        """How long until some queued job may go out (None if nothing is queued
+        or everything queued is waiting on a fetch in flight)."""
+        now = self.clock()
+        waits = []
+        for host in self._queued_hosts:
+            state = self._hosts[host]
+            if state.in_flight >= self.per_host_limit:
+                continue
+            wait_for = state.bucket.wait_time(now)
+            if state.ip in self._ips:
+                wait_for = max(wait_for, self._ips[state.ip].wait_time(now))
+            waits.append(wait_for)
+        return min(waits, default=None)
+
+    def finished(self, job, status=None, retry_after=None, ip=None):
+        """Report how job went. Returns True if it is done, False if it was
+        queued again because the host is throttling us."""
+        state = self._hosts[job.host]
+        state.in_flight -= 1
+        if ip:
+            self._set_ip(state, ip)
+
+        if status not in THROTTLE_STATUSES:
+            state.bucket.recover(self.host_rate)
+            self._forget_if_idle(job.host)
+            return True
+
+        self.stats["throttled"] += 1
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = DEFAULT_BACKOFF * 2 ** (job.attempts - 1)
+        if job.attempts > MAX_RETRIES or delay > MAX_RETRY_AFTER:
+            self.stats["gave_up"] += 1
+            self._forget_if_idle(job.host, throttled=True)
+            return True
+
+        state.bucket.pause(delay)
+        if state.ip in self._ips:
+            self._ips[state.ip].pause(delay)
+        self._queue(job, front=True)
+        return False
+
+    def _forget_if_idle(self, host, throttled=False):
+        # A million-domain scan sees a million hosts; one with nothing queued
+        # or in flight that never throttled us has nothing worth keeping, and
+        # neither has one we just gave up on
+        state = self._hosts[host]
+        if state.jobs or state.in_flight:
+            return
+        if throttled or state.bucket.rate == self.host_rate:
+            self._release_ip(state.ip)
+            del self._hosts[host]
+
+
+def dispatch(jobs, work, concurrency, scheduler, read_ahead=READ_AHEAD):
+    """Run work(url, item) over jobs ((url, item) pairs) on a thread pool, paced by
+    scheduler. work returns (result, document); yields (item, result, document)
+    as each job finishes for good."""
+    jobs = iter(jobs)
+    exhausted = False
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            # 1. Keep a window of upcoming domains queued
+            while not exhausted and scheduler.pending < read_ahead:
+                try:
+                    url, item = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                scheduler.add(url, item)
+
+            # 2. Hand out everything that may go now
+            while len(in_flight) < concurrency:
+                job = scheduler.next_job()
+                if job is None:
+                    break
+                in_flight[pool.submit(work, job.url, job.item)] = job
+
+            if not in_flight:
+                if exhausted and not scheduler.pending:
+                    return
+                time.sleep(scheduler.wait_time() or 0.05)
+                continue
+
+            # 3. Wait for a fetch to finish, or for a throttled host to open up
+            #    (with every worker busy only a finished fetch can free one up)
+            timeout = None if len(in_flight) >= concurrency else scheduler.wait_time()
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                result, document = future.result()
+                if scheduler.finished(job, document.status_code, document.headers.get("Retry-After"),
+                                      document.peer_ip):
+                    yield job.item, result, document
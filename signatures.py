@@ -0,0 +1,411 @@
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+
+# ============================================================
+# SIGNATURE MATCHER
+#
+# Every detector used to loop over its signatures and rescan the
+# whole page once per keyword. SignatureMatcher compiles all of them
+# into ONE regex and walks the page once, no matter how many
+# signatures there are.
+#
+# A signature is a dict with a "name" and any of:
+#   "keywords": plain ASCII strings, matched case-insensitively
+#   "regex":    regexes, for the few signatures that need one (ua-\d+)
+# Any other keys ("points", ...) are left alone for the caller.
+#
+# Pages can be given as str or as raw bytes. Bytes are matched as they
+# are, so a page never has to be decoded (and requests never has to
+# guess its charset) just to look for ASCII signatures.
+#
+# scan() takes a whole page; stream() returns a MatchStream that is fed
+# the page chunk by chunk and stops caring once everything is found.
+# ============================================================
+
+# How much of the previous chunk a stream keeps when a regex signature
+# is in play. Keyword-only sets keep exactly (longest keyword - 1).
+REGEX_OVERLAP = 256
+
+def _trie_regex(node):
+    # Turn a character trie into a regex that branches one character at
+    # a time. The regex engine then only follows the branch that matches
+    # the text, so the cost per position does not grow with the number
+    # of keywords. Optional tails are greedy, so the longest keyword at
+    # a given position is the one that gets reported.
+    ends_here = "" in node
+    branches = [re.escape(ch) + _trie_regex(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    if len(branches) == 1 and not ends_here:
+        return branches[0]
+    alternation = "(?:" + "|".join(branches) + ")"
+    return alternation + "?" if ends_here else alternation
+
+
+class _Compiled:
+    # The combined regex and lookup tables for one input type (str or bytes)
+    def __init__(self, keyword_owners, regexes, kind):
+        # Bytes patterns are built from the keywords' UTF-8 bytes. Going
+        # through latin-1 maps each byte to exactly one character, so the
+        # same trie code works for both.
+        if kind is bytes:
+            as_chars = lambda text: text.encode("utf-8").decode("latin-1")
+            to_kind = lambda chars: chars.encode("latin-1")
+            pattern_to_kind = lambda pattern: pattern.encode("utf-8")
+        else:
+            as_chars = to_kind = pattern_to_kind = lambda text: text
+        keyword_owners = {as_chars(k): owners for k, owners in keyword_owners.items()}
+
+        # 1. A hit on a keyword also means every shorter keyword that is a
+        #    prefix of it matched at the same spot (e.g. "shopify" inside
+        #    "shopify.cdn"), so fold those owners in up front
+        self.owners = {}
+        for keyword in keyword_owners:
+            owners = set()
+            for end in range(1, len(keyword) + 1):
+                owners |= keyword_owners.get(keyword[:end], set())
+            self.owners[to_kind(keyword)] = frozenset(owners)
+
+        # 2. Build the single combined regex: the keyword trie first, then
+        #    each regex in its own named group
+        trie = {}
+        for keyword in keyword_owners:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[""] = True
+        branches = []
+        if trie:
+            branches.append(to_kind("(?P<kw>" + _trie_regex(trie) + ")"))
+        for n, (_, pattern) in enumerate(regexes):
+            branches.append(pattern_to_kind(f"(?P<re{n}>(?i:{pattern}))"))
+        self.regex = re.compile(to_kind("|").join(branches) or to_kind("(?!)"))
+
+        # Patterns are also compiled on their own, so that when the combined
+        # regex stops at one branch we can still check the others at that spot
+        self.patterns = [
+            (index, re.compile(pattern_to_kind(pattern), re.IGNORECASE)) for index, pattern in regexes
+        ]
+
+        # A match can start near the end of one chunk and finish in the
+        # next, so streams carry this much over between chunks
+        self.overlap = max((len(k) - 1 for k in keyword_owners), default=0)
+        if regexes:
+            self.overlap = max(self.overlap, REGEX_OVERLAP)
+
+
+class SignatureMatcher:
+    def __init__(self, signatures):
+        self.signatures = list(signatures)
+
+        # Map every keyword to the signatures that use it
+        self._keyword_owners = {}
+        self._regexes = []
+        for index, sig in enumerate(self.signatures):
+            for keyword in sig.get("keywords", []):
+                self._keyword_owners.setdefault(keyword.lower(), set()).add(index)
+            for pattern in sig.get("regex", []):
+                self._regexes.append((index, pattern))
+
+        # Compiled on first use for each input type
+        self._compiled = {}
+
+    def compiled(self, kind):
+        if kind not in self._compiled:
+            self._compiled[kind] = _Compiled(self._keyword_owners, self._regexes, kind)
+        return self._compiled[kind]
+
+    def scan(self, text):
+        """Return the signatures found in text (str or bytes), in the order they were defined."""
+        found = set()
+        self._scan_into(text, found)
+        return [self.signatures[i] for i in sorted(found)]
+
+    def stream(self):
+        return MatchStream(self)
+
+    def _scan_into(self, text, found):
+        compiled = self.compiled(type(text))
+        # Lower-casing once up front is much cheaper than asking the regex
+        # engine to fold case at every position (bytes.lower() only touches
+        # ASCII, which is all our keywords need)
+        text = text.lower()
+        total = len(self.signatures)
+        search = compiled.regex.search
+        pos = 0
+
+        while len(found) < total:
+            m = search(text, pos)
+            if not m:
+                break
+            start = m.start()
+
+            if m.lastgroup == "kw":
+                found |= compiled.owners[m.group("kw")]
+            # Only one branch of the alternation reports per position, so
+            # give the other regex signatures a chance at the same spot
+            for index, pattern in compiled.patterns:
+                if index not in found and pattern.match(text, start):
+                    found.add(index)
+
+            # Step one character forward (not past the match), so keywords
+            # that start inside this match are still seen
+            pos = start + 1
+
+
+class MatchStream:
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.found = set()
+        self._tail = ""
+
+    @property
+    def done(self):
+        # Every signature has been seen, so more input cannot change anything
+        return len(self.found) == len(self.matcher.signatures)
+
+    def feed(self, text):
+        if self.done:
+            return
+        # Glue the end of the previous chunk on, so a keyword split across
+        # the boundary is still found
+        if self._tail:
+            text = self._tail + text
+        self.matcher._scan_into(text, self.found)
+        overlap = self.matcher.compiled(type(text)).overlap
+        self._tail = text[-overlap:] if overlap else text[:0]
+
+    def result(self):
+        return [self.matcher.signatures[i] for i in sorted(self.found)]
+
+
+# ============================================================
+# TAG EXTRACTOR
+#
+# Tag-scope signatures only count inside <script> and <link> tags.
+# Instead of building a whole BeautifulSoup tree to find those tags,
+# TagExtractor rides on html.parser's event callbacks (the same
+# tokenizer BeautifulSoup's 'html.parser' uses) and hands out just the
+# script/link attributes and inline script code, chunk by chunk, as
+# the page is fed in. Nothing else of the page is kept, except the src
+# of each <script> when a caller asks for them (bundles.py follows them).
+# ============================================================
+
+TAGS_TO_SCAN = ("script", "link")
+
+
+class TagExtractor(HTMLParser):
+    def __init__(self, emit, on_script_src=None):
+        super().__init__(convert_charrefs=False)
+        self.emit = emit
+        self.on_script_src = on_script_src
+        self._in_script = False
+
+    def feed(self, data):
+        # Raw bytes go in as latin-1, which keeps every ASCII signature
+        # intact without sniffing the page's real charset
+        if isinstance(data, bytes):
+            data = data.decode("latin-1")
+        super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in TAGS_TO_SCAN:
+            return
+        parts = [tag] + [f'{name}="{value}"' if value is not None else name for name, value in attrs]
+        self.emit("<" + " ".join(parts) + "> ")
+        self._in_script = tag == "script"
+        if self._in_script and self.on_script_src is not None:
+            for name, value in attrs:
+                if name == "src" and value:
+                    self.on_script_src(value)
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self._in_script = False
+
+    def handle_data(self, data):
+        # html.parser delivers everything up to </script> as data
+        if self._in_script:
+            self.emit(data)
+
+
+# ============================================================
+# SIGNATURE REGISTRY
+#
+# All signatures live in signatures.json (or the file named by the
+# SIGNALIQ_SIGNATURES environment variable), so new detectors can be
+# added without touching the code. Each entry has a name, category,
+# points, keywords/regex and a scope:
+#   "tags": only counts inside <script> and <link> tags
+#   "body": counts anywhere in the page
+# The file is parsed and compiled once per process (load_registry is
+# cached) and its "version" is stamped on every result.
+#
+# Every signature also has a numeric "id" that never changes or gets
+# reused. Stored results keep their detections as a bit set indexed by
+# it (detection_bits), which is what lets rescore.py recompute scores
+# without scanning again.
+# ============================================================
+
+REGISTRY_PATH = os.environ.get(
+    "SIGNALIQ_SIGNATURES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "signatures.json")
+)
+
+SCOPES = ("tags", "body")
+
+
+def extract_tag_text(html):
+    """Return the script/link tag code of a whole page as one string."""
+    pieces = []
+    extractor = TagExtractor(pieces.append)
+    extractor.feed(html)
+    extractor.close()
+    return "".join(pieces)
+
+
+class SignatureRegistry:
+    def __init__(self, data):
+        self.path = None               # set by load_registry
+        self.version = data["version"]
+        self.max_score = data.get("max_score", 100)
+        self.signatures = data["signatures"]
+
+        self.by_id = {}
+        self.by_name = {}
+        for sig in self.signatures:
+            if sig.get("scope", "body") not in SCOPES:
+                raise ValueError(f"Signature {sig['name']!r} has unknown scope {sig['scope']!r}")
+            sig_id = sig.get("id")
+            if not isinstance(sig_id, int) or sig_id < 0 or sig_id in self.by_id:
+                raise ValueError(f"Signature {sig['name']!r} needs a unique, non-negative integer id")
+            self.by_id[sig_id] = sig
+            self.by_name[sig["name"]] = sig
+
+        # Bits needed to hold every id
+        self.id_width = max(self.by_id, default=-1) + 1
+
+        self.tag_matcher = SignatureMatcher(s for s in self.signatures if s.get("scope") == "tags")
+        self.body_matcher = SignatureMatcher(s for s in self.signatures if s.get("scope", "body") == "body")
+        self._order = {id(sig): n for n, sig in enumerate(self.signatures)}
+
+    def precompile(self):
+        """Build every matcher regex now instead of on the first page (for a cold start)."""
+        for matcher in (self.tag_matcher, self.body_matcher):
+            for kind in (str, bytes):
+                matcher.compiled(kind)
+        return self
+
+    def detect(self, html):
+        """Return every signature found in html (str or bytes), in registry order."""
+        scanner = self.scanner()
+        scanner.feed(html)
+        return scanner.close()
+
+    def scanner(self):
+        return DocumentScanner(self)
+
+    def detect_with_tags(self, html, tag_mask):
+        """Like detect(html), but with the tag-scope signatures taken from tag_mask
+        (a detection mask, e.g. the last scan of a page whose tag_fingerprint has
+        not changed) and only the body-scope ones matched against html."""
+        tags = tag_mask & self.detection_mask(self.tag_matcher.signatures)
+        return self.signatures_in(tags | self.detection_mask(self.body_matcher.scan(html)))
+
+    def score(self, found, base=0):
+        """Add up the points of the found signatures, capped at max_score."""
+        return min(base + sum(sig.get("points", 0) for sig in found), self.max_score)
+
+    def detection_mask(self, found):
+        """Found signatures as an int: bit n is set when id n was found."""
+        mask = 0
+        for sig in found:
+            mask |= 1 << sig["id"]
+        return mask
+
+    def detection_bits(self, found):
+        """Pack found signatures into bytes (detection_mask, little-endian)."""
+        return self.detection_mask(found).to_bytes((self.id_width + 7) // 8, "little")
+
+    def signatures_in(self, mask):
+        """The signatures whose bits are set in mask, in registry order."""
+        return [sig for sig in self.signatures if mask >> sig["id"] & 1]
+
+    def points_vector(self):
+        """The points of every signature, indexed by id (0 for unused ids)."""
+        points = [0] * self.id_width
+        for sig_id, sig in self.by_id.items():
+            points[sig_id] = sig.get("points", 0)
+        return points
+
+
+# ============================================================
+# FINGERPRINTS
+#
+# Pages that have not changed since the last scan do not need the full
+# signature pass again. tag_fingerprint() hashes the set of <script> and
+# <link> tags of a page (inline script code included), which is where
+# the detections come from. It is found with one bytes regex, no HTML
+# parsing, so it costs a small fraction of registry.detect() on the same
+# page. A result can be reused when both its fingerprint and the
+# registry version it was scanned with still match.
+#
+# CSP nonces change on every request, so they are left out of the hash.
+# ============================================================
+
+TAG_FINGERPRINT_PATTERN = re.compile(
+    rb"<(?:link\b[^>]*>|script\b[^>]*>.*?</script\s*>)", re.IGNORECASE | re.DOTALL
+)
+NONCE_PATTERN = re.compile(rb"""\snonce\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]*)""", re.IGNORECASE)
+
+
+def tag_fingerprint(body):
+    """A short hex digest of the page's script/link tag set (order and duplicates ignored)."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    tags = {NONCE_PATTERN.sub(b"", tag.lower()) for tag in TAG_FINGERPRINT_PATTERN.findall(body)}
+    return hashlib.blake2b(b"\n".join(sorted(tags)), digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def load_registry(path=REGISTRY_PATH):
+    with open(path, encoding="utf-8") as f:
+        registry = SignatureRegistry(json.load(f))
+    registry.path = path
+    return registry
+
+
+class DocumentScanner:
+    """Runs the registry over a page that arrives in chunks (str or bytes).
+
+    Body-scope signatures are matched against the raw chunks. Tag-scope
+    signatures are matched against what TagExtractor pulls out of the
+    same chunks, so both are decided while the page is still streaming.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._body = registry.body_matcher.stream()
+        self._tags = registry.tag_matcher.stream()
+        self.script_srcs = []          # <script src> values seen so far, in page order
+        self._extractor = TagExtractor(self._tags.feed, self.script_srcs.append)
+
+    @property
+    def done(self):
+        return self._body.done and self._tags.done
+
+    def feed(self, chunk):
+        self._body.feed(chunk)
+        if not self._tags.done:
+            self._extractor.feed(chunk)
+
+    def close(self):
+        """Return every signature found, in registry order."""
+        if not self._tags.done:
+            self._extractor.close()
+        found = self._tags.result() + self._body.result()
+        return sorted(found, key=lambda sig: self.registry._order[id(sig)])
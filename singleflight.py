@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import Future
+
+
+# ============================================================
+# SINGLE FLIGHT
+#
+# The DNS cache (resolver.py), the result cache (result_cache.py) and
+# the script cache (bundles.py) all do slow work per key, and callers
+# asking for a key that is already being worked on should wait for
+# that answer instead of starting their own. SingleFlight is that
+# bookkeeping, kept in one place:
+#
+#   do(key, fn)               fn(), or the answer (or exception) of the
+#                             call for key already in flight
+#   start(key, fn, executor)  the same, in the background
+#
+# A key leaves the in-flight table before its answer is handed out, so
+# a caller that arrives in between starts afresh (and normally finds the
+# answer in its cache first) instead of joining a finished call.
+# ============================================================
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}   # key -> Future of the call in flight
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def _claim(self, key):
+        # (future, True) if the caller is to make the call, (future, False) to wait for it
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _run(self, key, future, fn):
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._calls[key]
+        future.set_result(value)
+        return value
+
+    def do(self, key, fn, timeout=None):
+        """(fn(), False), or (answer of the call for key in flight, True) after
+        waiting up to timeout seconds for it (concurrent.futures.TimeoutError)."""
+        future, mine = self._claim(key)
+        if not mine:
+            return future.result(timeout), True
+        return self._run(key, future, fn), False
+
+    def start(self, key, fn, executor):
+        """Call fn on executor, unless a call for key is in flight. Whether it was started."""
+        future, mine = self._claim(key)
+        if mine:
+            try:
+                executor.submit(self._run, key, future, fn)
+            except BaseException as e:
+                # Shut down: nothing will ever answer anyone waiting for it
+                with self._lock:
+                    del self._calls[key]
+                future.set_exception(e)
+                raise
+        return mine
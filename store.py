@@ -0,0 +1,328 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from fetcher import normalize_url
+from signatures import load_registry
+
+
+# ============================================================
+# RESULTS STORE
+#
+# scan_results.csv kept the tech stack as one comma-joined string, so
+# "every Shopify store scoring above 40" meant parsing the whole file.
+# ResultStore keeps results in a SQLite file instead:
+#
+#   scans         one row per bulk scan (started/finished, signature version)
+#   results       one row per domain per scan; a rescan of the same
+#                 domain in the same scan replaces (upserts) its row
+#   technologies  one row per domain per scan per detected technology
+#   domains       the latest scan of every domain, for the queries
+#
+# Each result also keeps the page's tag_fingerprint (signatures.py), so
+# a rescan can reuse it when the page has not changed (see previous()),
+# and its detections packed as a bit set by signature id, so scores can
+# be recomputed for new points without scanning (rescore.py).
+# signature_version is the signature set the detections were found with
+# (what the reuse check compares); points_version is the one whose points
+# the score was last computed with.
+#
+# Indexed on score, technology and scan time. top_by_score() and
+# top_by_technology() answer from the latest scan of each domain, and
+# export_csv() still writes the old scan_results.csv layout.
+#
+# A failed scan (fetch error, still rate limited) is kept with its
+# error, but never replaces a domain's last good result as the one the
+# queries and previous() see.
+#
+# Set SIGNALIQ_STORE to move the file.
+# ============================================================
+
+STORE_PATH = os.environ.get("SIGNALIQ_STORE", "scan_results.sqlite")
+
+# The columns of the old scan_results.csv, kept for export_csv
+CSV_FIELDNAMES = ["URL", "Score", "Tech Stack", "Signature Version"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    signature_version TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    domain TEXT NOT NULL,
+    scan_id INTEGER NOT NULL REFERENCES scans (id),
+    url TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    tech_stack TEXT NOT NULL,
+    signature_version TEXT,
+    fingerprint TEXT,
+    detections BLOB,
+    error TEXT,
+    points_version TEXT,
+    scanned_at REAL NOT NULL,
+    PRIMARY KEY (domain, scan_id)
+);
+CREATE TABLE IF NOT EXISTS technologies (
+    domain TEXT NOT NULL,
+    scan_id INTEGER NOT NULL,
+    technology TEXT NOT NULL,
+    PRIMARY KEY (domain, scan_id, technology)
+);
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    scan_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_score ON results (score);
+CREATE INDEX IF NOT EXISTS results_scanned_at ON results (scanned_at);
+CREATE INDEX IF NOT EXISTS technologies_technology ON technologies (technology, domain, scan_id);
+CREATE INDEX IF NOT EXISTS domains_score ON domains (score);
+CREATE INDEX IF NOT EXISTS domains_scanned_at ON domains (scanned_at);
+"""
+
+# What the query methods hand back for each row
+RESULT_COLUMNS = ("domain", "scan_id", "url", "score", "tech_stack", "signature_version", "scanned_at")
+
+
+def domain_of(url):
+    """The store's key for a site: host (and port, if not the default) of the normalized URL."""
+    return urlsplit(normalize_url(url)).netloc
+
+
+def split_tech_stack(tech_stack):
+    # "Meta Ads, Shopify" -> ["Meta Ads", "Shopify"]
+    return [name.strip() for name in tech_stack.split(",") if name.strip()] if tech_stack else []
+
+
+class ResultStore:
+    def __init__(self, path=STORE_PATH, registry=None):
+        self.path = path
+        self.registry = registry or load_registry()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Stores created before fingerprints / detection bits / errors / points versions were kept
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(results)")]
+        if "fingerprint" not in columns:
+            self._db.execute("ALTER TABLE results ADD COLUMN fingerprint TEXT")
+        if "error" not in columns:
+            self._db.execute("ALTER TABLE results ADD COLUMN error TEXT")
+        if "points_version" not in columns:
+            self._db.execute("ALTER TABLE results ADD COLUMN points_version TEXT")
+            self._db.execute("UPDATE results SET points_version = signature_version")
+        if "detections" not in columns:
+            self._db.execute("ALTER TABLE results ADD COLUMN detections BLOB")
+            rows = self._db.execute("SELECT rowid, tech_stack FROM results").fetchall()
+            self._db.executemany(
+                "UPDATE results SET detections = ? WHERE rowid = ?",
+                ((self.detection_bits(tech_stack), rowid) for rowid, tech_stack in rows),
+            )
+        self._db.commit()
+
+    def detection_bits(self, tech_stack):
+        # Names the registry no longer has are left out
+        found = [self.registry.by_name[name] for name in split_tech_stack(tech_stack) if name in self.registry.by_name]
+        return self.registry.detection_bits(found)
+
+    # --- writing ---
+
+    def begin_scan(self, signature_version=None, resume=True):
+        """Return the id to store a bulk scan's rows under. With resume=True an
+        unfinished scan (an interrupted run) is picked up instead of starting a new one."""
+        with self._lock:
+            if resume:
+                row = self._db.execute(
+                    "SELECT id FROM scans WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1"
+                ).fetchone()
+                if row:
+                    return row[0]
+            scan_id = self._db.execute(
+                "INSERT INTO scans (started_at, signature_version) VALUES (?, ?)",
+                (time.time(), signature_version),
+            ).lastrowid
+            self._db.commit()
+            return scan_id
+
+    def finish_scan(self, scan_id):
+        with self._lock:
+            self._db.execute("UPDATE scans SET finished_at = ? WHERE id = ?", (time.time(), scan_id))
+            self._db.commit()
+
+    def upsert(self, scan_id, row, scanned_at=None):
+        """Store one scan_website row (the CSV layout). Not committed until commit()."""
+        domain = domain_of(row["URL"])
+        scanned_at = scanned_at or time.time()
+        score = int(row["Score"] or 0)
+        technologies = split_tech_stack(row["Tech Stack"])
+        error = row.get("Error") or None
+
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO results (domain, scan_id, url, score, tech_stack, signature_version, fingerprint,"
+                " detections, error, points_version, scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (domain, scan_id) DO UPDATE SET url = excluded.url, score = excluded.score,"
+                " tech_stack = excluded.tech_stack, signature_version = excluded.signature_version,"
+                " fingerprint = excluded.fingerprint, detections = excluded.detections,"
+                " error = excluded.error, points_version = excluded.points_version,"
+                " scanned_at = excluded.scanned_at",
+                (domain, scan_id, row["URL"], score, ", ".join(technologies), row.get("Signature Version"),
+                 row.get("Fingerprint"), self.detection_bits(row["Tech Stack"]), error,
+                 row.get("Signature Version"), scanned_at),
+            )
+            self._db.execute("DELETE FROM technologies WHERE domain = ? AND scan_id = ?", (domain, scan_id))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO technologies (domain, scan_id, technology) VALUES (?, ?, ?)",
+                ((domain, scan_id, name) for name in technologies),
+            )
+            # The queries look at the newest scan of each domain; a failed
+            # one only stands in for a domain that has nothing better
+            if error is None:
+                self._db.execute(
+                    "INSERT INTO domains (domain, scan_id, score, scanned_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (domain) DO UPDATE SET scan_id = excluded.scan_id, score = excluded.score,"
+                    " scanned_at = excluded.scanned_at WHERE excluded.scanned_at >= domains.scanned_at",
+                    (domain, scan_id, score, scanned_at),
+                )
+            else:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO domains (domain, scan_id, score, scanned_at) VALUES (?, ?, ?, ?)",
+                    (domain, scan_id, score, scanned_at),
+                )
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    # --- re-scoring (see rescore.py) ---
+
+    def iter_detections(self, batch_size):
+        """Yield (rowids, scores, detection blobs) for every stored result, batch_size rows at a time."""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT rowid, score, detections FROM results WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [row[0] for row in rows], [row[1] for row in rows], [row[2] or b"" for row in rows]
+
+    def update_scores(self, rowid_scores):
+        """Write new scores for (rowid, score) pairs."""
+        with self._lock:
+            self._db.executemany("UPDATE results SET score = ? WHERE rowid = ?",
+                                 ((score, rowid) for rowid, score in rowid_scores))
+            self._db.commit()
+
+    def set_points_version(self, version):
+        """Record that every stored score now uses the points of signature set version."""
+        with self._lock:
+            self._db.execute("UPDATE results SET points_version = ? WHERE points_version IS NOT ?",
+                             (version, version))
+            self._db.commit()
+
+    def sync_latest_scores(self):
+        """Copy result scores into the latest-scan table after update_scores."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE domains SET score = (SELECT r.score FROM results r"
+                " WHERE r.domain = domains.domain AND r.scan_id = domains.scan_id)"
+            )
+            self._db.commit()
+
+    # --- queries ---
+
+    def _rows(self, sql, params):
+        with self._lock:
+            return [dict(zip(RESULT_COLUMNS, row)) for row in self._db.execute(sql, params)]
+
+    def top_by_score(self, n=10, min_score=0):
+        """The n highest scoring domains (latest scan of each)."""
+        return self._rows(
+            "SELECT r.domain, r.scan_id, r.url, r.score, r.tech_stack, r.signature_version, r.scanned_at"
+            " FROM domains d JOIN results r ON r.domain = d.domain AND r.scan_id = d.scan_id"
+            " WHERE d.score >= ? AND r.error IS NULL ORDER BY d.score DESC, d.domain LIMIT ?",
+            (min_score, n),
+        )
+
+    def top_by_technology(self, technology, n=10, min_score=0):
+        """The n highest scoring domains running technology, e.g. ("Shopify", min_score=40)."""
+        return self._rows(
+            "SELECT r.domain, r.scan_id, r.url, r.score, r.tech_stack, r.signature_version, r.scanned_at"
+            " FROM technologies t"
+            " JOIN domains d ON d.domain = t.domain AND d.scan_id = t.scan_id"
+            " JOIN results r ON r.domain = d.domain AND r.scan_id = d.scan_id"
+            " WHERE t.technology = ? AND d.score >= ? AND r.error IS NULL ORDER BY d.score DESC, d.domain LIMIT ?",
+            (technology, min_score, n),
+        )
+
+    def previous(self, url):
+        """The latest stored result for url's domain, with its fingerprint, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT r.url, r.score, r.tech_stack, r.signature_version, r.fingerprint, r.detections"
+                " FROM domains d JOIN results r ON r.domain = d.domain AND r.scan_id = d.scan_id"
+                " WHERE d.domain = ? AND r.error IS NULL",
+                (domain_of(url),),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url", "score", "tech_stack", "signature_version", "fingerprint", "detections"), row))
+
+    def history(self, url):
+        """Every stored scan of one domain, newest first."""
+        return self._rows(
+            "SELECT domain, scan_id, url, score, tech_stack, signature_version, scanned_at"
+            " FROM results WHERE domain = ? ORDER BY scanned_at DESC",
+            (domain_of(url),),
+        )
+
+    # --- CSV compatibility ---
+
+    def export_csv(self, path, scan_id=None):
+        """Write the latest result of every domain (or one scan's rows) in the
+        old scan_results.csv layout. Returns the number of rows written."""
+        if scan_id is None:
+            sql = ("SELECT r.url, r.score, r.tech_stack, r.signature_version FROM domains d"
+                   " JOIN results r ON r.domain = d.domain AND r.scan_id = d.scan_id ORDER BY r.scanned_at")
+            params = ()
+        else:
+            sql = "SELECT url, score, tech_stack, signature_version FROM results WHERE scan_id = ? ORDER BY scanned_at"
+            params = (scan_id,)
+
+        written = 0
+        with open(path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(CSV_FIELDNAMES)
+            with self._lock:
+                for row in self._db.execute(sql, params):
+                    writer.writerow(row)
+                    written += 1
+        return written
+
+    def import_csv(self, path):
+        """Load an old scan_results.csv as one finished scan. Returns its scan id."""
+        scan_id = self.begin_scan(resume=False)
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                self.upsert(scan_id, row)
+        self.finish_scan(scan_id)
+        return scan_id